@@ -76,9 +76,9 @@ class Actor(object):
         self.update_weights()
         self.sampler.reset()
         local_steps = 0
+        explore_fn = lambda o: self.agent.act_batch_explore(o, None)
         while True:
-            self.sampler.sample(num_steps=1, collect_fn=lambda o: self.agent.act_batch_explore(o, None),
-                                replay_buffer=self.local_buffer)
+            self.sampler.sample(num_steps=1, collect_fn=explore_fn, replay_buffer=self.local_buffer)
             local_steps += 1
             if self.local_buffer.is_full():
                 data = self.local_buffer.storage.get()
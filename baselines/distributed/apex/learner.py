@@ -5,6 +5,7 @@ import time
 import ray
 from ray.util import queue
 
+import rlutils.pytorch.utils as ptu
 from rlutils import logx
 
 
@@ -110,7 +111,7 @@ class Learner(object):
             self.policy_updates += 1
             transaction_id, data = self.get_data()
             info = self.agent.train_on_batch(data)
-            self.replay_manager.update_priorities.remote(transaction_id, info['TDError'])
+            self.replay_manager.update_priorities.remote(transaction_id, ptu.to_numpy(info['TDError']))
 
             if self.policy_updates % self.weight_push_freq:
                 self.store_weights()
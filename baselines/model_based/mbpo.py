@@ -43,7 +43,7 @@ def generate_model_rollouts(env, agent, dynamics_model, real_dataset, rollout_le
         data['obs'].append(obs)
         data['act'].append(act)
         data['next_obs'].append(next_obs)
-        data['rew'].append(reward)
+        data['rew'].append(reward * agent.reward_scale)
         data['done'].append(terminate)
 
         obs = next_obs.clone()  # the clone is critical.
@@ -124,6 +124,7 @@ def main(env_name,
     agent = SACAgent(env=dummy_env, target_entropy=-env.action_space.shape[0] // 2, device=device)
     dynamics_model = rlu.nn.MLPDynamics(env=dummy_env, device=device)
     sampler = rl_infra.samplers.BatchSampler(env=env, n_steps=1, gamma=gamma,
+                                             reward_scale=agent.reward_scale,
                                              seed=seeder.generate_seed())
 
     # setup tester
@@ -150,6 +151,9 @@ def main(env_name,
     data = real_replay_buffer.storage.get()
     dynamics_model.fit(data=data, num_epochs=model_training_epochs, batch_size=model_training_batch_size)
 
+    # created once instead of every env step. explore_fn reads the current global_step
+    explore_fn = lambda obs: agent.act_batch_explore(obs, global_step)
+
     for epoch in range(1, epochs + 1):
         # step 2: train dynamics model
         rollout_length = int(rollout_length_scheduler.value(epoch))
@@ -157,7 +161,7 @@ def main(env_name,
         for t in trange(steps_per_epoch, desc=f'Epoch {epoch}/{epochs}'):
             # step 1: add data to true dataset
             sampler.sample(num_steps=1,
-                           collect_fn=lambda obs: agent.act_batch_explore(obs, global_step),
+                           collect_fn=explore_fn,
                            replay_buffer=real_replay_buffer)
 
             # step 3: perform model rollouts
@@ -179,7 +183,7 @@ def main(env_name,
                 data = real_replay_buffer.storage.get()
                 dynamics_model.fit(data=data, num_epochs=model_training_epochs, batch_size=model_training_batch_size)
 
-        tester.test_agent(get_action=lambda obs: agent.act_batch_test(obs),
+        tester.test_agent(get_action=agent.act_batch_test,
                           name=agent.__class__.__name__,
                           num_test_episodes=num_test_episodes)
         # Log info about epoch
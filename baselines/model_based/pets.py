@@ -132,10 +132,13 @@ def pets(env_name,
     data = real_replay_buffer.storage.get()
     dynamics_model.fit(data=data, num_epochs=model_training_epochs, batch_size=model_training_batch_size)
 
+    # created once instead of every env step. explore_fn reads the current global_step
+    explore_fn = lambda obs: agent.act_batch_explore(obs, global_step)
+
     for epoch in range(1, epochs + 1):
         for t in trange(steps_per_epoch, desc=f'Epoch {epoch}/{epochs}'):
             sampler.sample(num_steps=1,
-                           collect_fn=lambda obs: agent.act_batch_explore(obs, global_step),
+                           collect_fn=explore_fn,
                            replay_buffer=real_replay_buffer)
 
             global_step += 1
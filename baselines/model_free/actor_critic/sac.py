@@ -32,6 +32,7 @@ class SACAgent(OffPolicyAgent, nn.Module):
                  tau=5e-3,
                  target_entropy=None,
                  reward_scale=1.0,
+                 torch_compile=False,
                  device=ptu.device
                  ):
         nn.Module.__init__(self)
@@ -44,7 +45,9 @@ class SACAgent(OffPolicyAgent, nn.Module):
         self.alpha_lr = alpha_lr
         self.act_dim = self.act_spec.shape[0]
         self.policy_net = make_policy_net(env)
+        self.policy_params = list(self.policy_net.parameters())
         self.num_q_ensembles = num_q_ensembles
+        # the rewards in the replay buffer are expected to be scaled by reward_scale. See BatchSampler.
         self.reward_scale = reward_scale
         self.q_network = make_q_network(env, self.num_q_ensembles)
         self.target_q_network = copy.deepcopy(self.q_network)
@@ -56,10 +59,17 @@ class SACAgent(OffPolicyAgent, nn.Module):
 
         self.tau = tau
 
+        # compile the forward and backward of the losses. The optimizer steps stay in Python.
+        self.torch_compile = torch_compile
+        if self.torch_compile:
+            self.compute_q_loss = torch.compile(self.compute_q_loss)
+            self.compute_policy_loss = torch.compile(self.compute_policy_loss)
+
         self.reset_optimizer()
 
         self.device = device
         self.to(device)
+        self.convert_dict_to_tensor = ptu.PinnedDictConverter(self.device)
 
     def reset_optimizer(self):
         self.policy_optimizer = torch.optim.Adam(params=self.policy_net.parameters(), lr=self.policy_lr)
@@ -79,6 +89,26 @@ class SACAgent(OffPolicyAgent, nn.Module):
     def update_target(self):
         rlu.functional.soft_update(self.target_q_network, self.q_network, self.tau)
 
+    def compute_q_loss(self, obs, act, next_obs, done, rew, gamma, alpha):
+        with torch.no_grad():
+            next_action, next_action_log_prob, _ = self.policy_net((next_obs, False))
+            target_q_values = self.target_q_network((next_obs, next_action),
+                                                    training=False) - alpha * next_action_log_prob
+            q_target = rew + gamma * (1.0 - done) * target_q_values
+
+        q_values = self.q_network((obs, act), training=True)  # (num_ensembles, None)
+        # q_target broadcasts over the ensembles and the 0.5 scaling is applied after the reduction
+        q_values_loss = 0.5 * torch.sum(torch.square(q_values - q_target), dim=0)  # (None,)
+        # apply importance weights
+        q_values_loss = torch.mean(q_values_loss)
+        return q_values_loss, q_values
+
+    def compute_policy_loss(self, obs, alpha):
+        action, log_prob, _ = self.policy_net((obs, False))
+        q_values_pi_min = self.q_network((obs, action), training=False)
+        policy_loss = torch.mean(log_prob * alpha - q_values_pi_min)
+        return policy_loss, log_prob
+
     def train_on_batch_torch(self, obs, act, next_obs, done, rew, gamma):
         """ Sample a mini-batch from replay buffer and update the network
 
@@ -94,28 +124,18 @@ class SACAgent(OffPolicyAgent, nn.Module):
         """
         with torch.no_grad():
             alpha = self.alpha_net()
-            next_action, next_action_log_prob, _, _ = self.policy_net((next_obs, False))
-            target_q_values = self.target_q_network((next_obs, next_action),
-                                                    training=False) - alpha * next_action_log_prob
-            q_target = rew * self.reward_scale + gamma * (1.0 - done) * target_q_values
 
         # q loss
-        q_values = self.q_network((obs, act), training=True)  # (num_ensembles, None)
-        q_values_loss = 0.5 * torch.square(torch.unsqueeze(q_target, dim=0) - q_values)
-        # (num_ensembles, None)
-        q_values_loss = torch.sum(q_values_loss, dim=0)  # (None,)
-        # apply importance weights
-        q_values_loss = torch.mean(q_values_loss)
+        q_values_loss, q_values = self.compute_q_loss(obs, act, next_obs, done, rew, gamma, alpha)
         self.q_optimizer.zero_grad()
         q_values_loss.backward()
         self.q_optimizer.step()
 
-        # policy loss
-        action, log_prob, _, _ = self.policy_net((obs, False))
-        q_values_pi_min = self.q_network((obs, action), training=False)
-        policy_loss = torch.mean(log_prob * alpha - q_values_pi_min)
+        # policy loss. Only accumulate into the policy parameters, so that the backward pass skips the unused
+        # Q parameter gradients.
+        policy_loss, log_prob = self.compute_policy_loss(obs, alpha)
         self.policy_optimizer.zero_grad()
-        policy_loss.backward()
+        policy_loss.backward(inputs=self.policy_params)
         self.policy_optimizer.step()
 
         alpha = self.alpha_net()
@@ -138,13 +158,14 @@ class SACAgent(OffPolicyAgent, nn.Module):
         return info
 
     def train_on_batch(self, data):
-        data = ptu.convert_dict_to_tensor(data, device=self.device)
+        data = self.convert_dict_to_tensor(data)
         info = self.train_on_batch_torch(**data)
         self.logger.store(**info)
         self.update_target()
 
     def act_batch_torch(self, obs, deterministic):
-        with torch.no_grad():
+        # rollouts never backpropagate. inference_mode also skips the version counter and view tracking
+        with torch.inference_mode():
             pi_final = self.policy_net.select_action((obs, deterministic))
             return pi_final
 
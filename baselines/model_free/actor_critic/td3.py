@@ -3,8 +3,9 @@ Twin Delayed DDPG. https://arxiv.org/abs/1802.09477.
 To obtain DDPG, set target smooth to zero and Q network ensembles to 1.
 """
 
-import copy
+import math
 
+import numpy as np
 import torch
 import torch.nn as nn
 
@@ -36,6 +37,9 @@ class TD3Agent(nn.Module, OffPolicyAgent):
                  target_noise=0.2,
                  noise_clip=0.5,
                  reward_scale=1.0,
+                 amp=False,
+                 target_dtype=None,
+                 cuda_graph=False,
                  device=ptu.device
                  ):
         nn.Module.__init__(self)
@@ -45,7 +49,7 @@ class TD3Agent(nn.Module, OffPolicyAgent):
         self.act_spec = env.action_space
         self.act_dim = self.act_spec.shape[0]
         verify_continuous_action_space(self.act_spec)
-        self.act_lim = self.act_spec.high[0]
+        self.act_lim = float(self.act_spec.high[0])
         self.actor_noise = actor_noise
         self.target_noise = target_noise
         self.noise_clip = noise_clip
@@ -54,27 +58,68 @@ class TD3Agent(nn.Module, OffPolicyAgent):
         self.q_lr = q_lr
         self.num_q_ensembles = num_q_ensembles
         self.device = device
+        # the rewards in the replay buffer are expected to be scaled by reward_scale. See BatchSampler.
         self.reward_scale = reward_scale
         self.policy_update_freq = policy_update_freq
+        # automatic mixed precision only takes effect on cuda
+        self.amp = amp and ptu.is_cuda_device(self.device)
+        # capture the update step as cuda graphs. The GradScaler syncs with the host, so it can't be captured.
+        self.cuda_graph = cuda_graph and ptu.is_cuda_device(self.device)
+        assert not (self.amp and self.cuda_graph), 'amp and cuda_graph can not be used together'
 
         self.obs_dim = self.obs_spec.shape[0]
         self.policy_net = make_policy_net(env)
-        self.target_policy_net = copy.deepcopy(self.policy_net)
+        # build the targets from the factories instead of deepcopy and copy the weights
+        self.target_policy_net = make_policy_net(env)
+        self.target_policy_net.load_state_dict(self.policy_net.state_dict())
         self.q_network = make_q_network(env, num_q_ensembles)
-        self.target_q_network = copy.deepcopy(self.q_network)
+        self.target_q_network = make_q_network(env, num_q_ensembles)
+        self.target_q_network.load_state_dict(self.q_network.state_dict())
+        # the train/eval toggles only matter if the Q network contains dropout or batch normalization
+        self.q_has_dropout = any(isinstance(m, (nn.modules.dropout._DropoutNd, nn.modules.batchnorm._BatchNorm))
+                                 for m in self.q_network.modules())
 
         rlu.nn.functional.freeze(self.target_policy_net)
         rlu.nn.functional.freeze(self.target_q_network)
 
-        self.reset_optimizer()
-
+        # the target networks are only used for inference. When target_dtype (e.g. torch.bfloat16) is set, we keep
+        # the fp32 targets for polyak averaging and use a low precision copy to compute the target values.
+        self.target_dtype = target_dtype
+        if self.target_dtype is not None:
+            self.target_policy_net_lp = make_policy_net(env).to(dtype=self.target_dtype)
+            self.target_policy_net_lp.load_state_dict(self.target_policy_net.state_dict())
+            self.target_q_network_lp = make_q_network(env, num_q_ensembles).to(dtype=self.target_dtype)
+            self.target_q_network_lp.load_state_dict(self.target_q_network.state_dict())
+            rlu.nn.functional.freeze(self.target_policy_net_lp)
+            rlu.nn.functional.freeze(self.target_q_network_lp)
+            self.target_lp_params = list(self.target_q_network_lp.parameters()) + \
+                                    list(self.target_policy_net_lp.parameters())
+        # cache the parameter lists for the target updates
+        self.source_params = list(self.q_network.parameters()) + list(self.policy_net.parameters())
+        self.target_params = list(self.target_q_network.parameters()) + list(self.target_policy_net.parameters())
+
+        # the fused optimizers require the parameters to be on the device
         self.to(self.device)
 
+        self.reset_optimizer()
+        self.q_scaler = torch.cuda.amp.GradScaler(enabled=self.amp)
+        self.pi_scaler = torch.cuda.amp.GradScaler(enabled=self.amp)
+        self.convert_dict_to_tensor = ptu.PinnedDictConverter(self.device)
+        # reusable observation buffer for act_batch_test/explore on cuda, allocated on the first call
+        self.act_obs_buf = None
+
         self.policy_updates = 0
 
     def reset_optimizer(self):
-        self.policy_optimizer = torch.optim.Adam(params=self.policy_net.parameters(), lr=self.policy_lr)
-        self.q_optimizer = torch.optim.Adam(params=self.q_network.parameters(), lr=self.q_lr)
+        # fused Adam only supports cuda
+        fused = ptu.is_cuda_device(self.device)
+        self.policy_optimizer = torch.optim.Adam(params=self.policy_net.parameters(), lr=self.policy_lr,
+                                                 capturable=self.cuda_graph, fused=fused)
+        self.q_optimizer = torch.optim.Adam(params=self.q_network.parameters(), lr=self.q_lr,
+                                            capturable=self.cuda_graph, fused=fused)
+        # the captured graphs refer to the old optimizers
+        self.cuda_graphs = {}
+        self.static_data = None
 
     def log_tabular(self):
         for i in range(self.num_q_ensembles):
@@ -85,56 +130,69 @@ class TD3Agent(nn.Module, OffPolicyAgent):
         super(TD3Agent, self).log_tabular()
 
     def update_target(self):
-        rlu.functional.soft_update(self.target_q_network, self.q_network, self.tau)
-        rlu.functional.soft_update(self.target_policy_net, self.policy_net, self.tau)
+        rlu.functional.soft_update_params(self.target_params, self.source_params, self.tau)
+        if self.target_dtype is not None:
+            rlu.functional.hard_update_params(self.target_lp_params, self.target_params)
 
-    def compute_next_obs_q_torch(self, next_obs):
-        next_action = self.target_policy_net(next_obs)
+    def autocast(self):
+        return torch.autocast(device_type='cuda', dtype=torch.float16, enabled=self.amp)
+
+    def _compute_next_obs_q_torch(self, target_policy_net, target_q_network, next_obs):
+        next_action = target_policy_net(next_obs)
         # Target policy smoothing
-        epsilon = torch.randn_like(next_action) * self.target_noise
-        epsilon = torch.clip(epsilon, -self.noise_clip, self.noise_clip)
-        next_action = next_action + epsilon
-        next_action = torch.clip(next_action, -self.act_lim, self.act_lim)
-        next_q_value = self.target_q_network((next_obs, next_action), training=False)
+        next_action = rlu.functional.add_clipped_noise(next_action, self.target_noise, self.noise_clip, self.act_lim)
+        next_q_value = target_q_network((next_obs, next_action), training=False)
         return next_q_value
 
+    def compute_next_obs_q_torch(self, next_obs):
+        if self.target_dtype is not None:
+            next_q_value = self._compute_next_obs_q_torch(self.target_policy_net_lp, self.target_q_network_lp,
+                                                          next_obs.to(self.target_dtype))
+        else:
+            with self.autocast():
+                next_q_value = self._compute_next_obs_q_torch(self.target_policy_net, self.target_q_network,
+                                                              next_obs)
+        return next_q_value.float()
+
     def compute_priority(self, data):
-        data = ptu.convert_dict_to_tensor(data, device=self.device)
+        data = self.convert_dict_to_tensor(data)
         td_error = self.compute_priority_torch(**data)
         return ptu.to_numpy(td_error)
 
     def compute_priority_torch(self, obs, act, next_obs, done, rew, gamma):
         with torch.no_grad():
             next_q_value = self.compute_next_obs_q_torch(next_obs)
-            q_target = rew * self.reward_scale + gamma * (1.0 - done) * next_q_value
-            q_values = self.q_network((obs, act), training=False)  # (None,)
-            abs_td_error = torch.abs(q_values - q_target)
+            q_target = rew + gamma * (1.0 - done) * next_q_value
+            with self.autocast():
+                q_values = self.q_network((obs, act), training=False)  # (None,)
+            abs_td_error = torch.abs(q_values.float() - q_target)
             return abs_td_error
 
     def train_q_network_on_batch_torch(self, obs, act, next_obs, done, rew, gamma, weights=None):
         # compute target q
         with torch.no_grad():
             next_q_value = self.compute_next_obs_q_torch(next_obs)
-            q_target = rew * self.reward_scale + gamma * (1.0 - done) * next_q_value
+            q_target = rew + gamma * (1.0 - done) * next_q_value
         # q loss
         self.q_optimizer.zero_grad()
-        q_values = self.q_network((obs, act), training=True)  # (num_ensembles, None)
-        q_values_loss = 0.5 * torch.square(torch.unsqueeze(q_target, dim=0) - q_values)
-        # (num_ensembles, None)
-        q_values_loss = torch.sum(q_values_loss, dim=0)  # (None,)
-        # apply importance weights
-        if weights is not None:
-            q_values_loss = q_values_loss * weights
-        q_values_loss = torch.mean(q_values_loss)
-        q_values_loss.backward()
-        self.q_optimizer.step()
+        with self.autocast():
+            q_values = self.q_network((obs, act), training=True)  # (num_ensembles, None)
+            # q_target broadcasts over the ensembles and the 0.5 scaling is applied after the reduction
+            q_values_loss = 0.5 * torch.sum(torch.square(q_values - q_target), dim=0)  # (None,)
+            # apply importance weights
+            if weights is not None:
+                q_values_loss = q_values_loss * weights
+            q_values_loss = torch.mean(q_values_loss)
+        self.q_scaler.scale(q_values_loss).backward()
+        self.q_scaler.step(self.q_optimizer)
+        self.q_scaler.update()
 
         with torch.no_grad():
-            abs_td_error = torch.abs(torch.min(q_values, dim=0)[0] - q_target)
+            abs_td_error = (torch.amin(q_values, dim=0) - q_target).abs_()
 
         info = dict(
             LossQ=q_values_loss.detach(),
-            TDError=ptu.to_numpy(abs_td_error.detach())
+            TDError=abs_td_error.detach()
         )
         for i in range(self.num_q_ensembles):
             info[f'Q{i + 1}Vals'] = q_values[i].detach()
@@ -142,30 +200,103 @@ class TD3Agent(nn.Module, OffPolicyAgent):
 
     def train_actor_on_batch_torch(self, obs):
         # policy loss
-        self.q_network.eval()
+        if self.q_has_dropout:
+            self.q_network.eval()
         self.policy_optimizer.zero_grad()
-        a = self.policy_net(obs)
-        q = self.q_network((obs, a), training=False)
-        policy_loss = -torch.mean(q, dim=0)
-        policy_loss.backward()
-        self.policy_optimizer.step()
-        self.q_network.train()
+        with self.autocast():
+            a = self.policy_net(obs)
+            q = self.q_network((obs, a), training=False)
+            policy_loss = -torch.mean(q, dim=0)
+        self.pi_scaler.scale(policy_loss).backward()
+        self.pi_scaler.step(self.policy_optimizer)
+        self.pi_scaler.update()
+        if self.q_has_dropout:
+            self.q_network.train()
         info = dict(
             LossPi=policy_loss.detach(),
         )
         return info
 
+    def train_on_batch_torch(self, data, update_actor):
+        info = self.train_q_network_on_batch_torch(**data)
+        if update_actor:
+            actor_info = self.train_actor_on_batch_torch(data['obs'])
+            info.update(actor_info)
+            self.update_target()
+        return info
+
+    def snapshot_train_state(self):
+        """ Copy the networks and the optimizer states, including the targets """
+        networks = {key: val.clone() for key, val in self.state_dict().items()}
+        optimizers = []
+        for optimizer in (self.policy_optimizer, self.q_optimizer):
+            optimizers.append({param: {key: val.clone() if torch.is_tensor(val) else val for key, val in state.items()}
+                               for param, state in optimizer.state.items()})
+        return networks, optimizers
+
+    def restore_train_state(self, snapshot):
+        """ Restore a snapshot in place, so that the captured graphs keep pointing at the same tensors """
+        networks, optimizers = snapshot
+        with torch.no_grad():
+            for key, val in self.state_dict().items():
+                val.copy_(networks[key])
+            for optimizer, saved in zip((self.policy_optimizer, self.q_optimizer), optimizers):
+                for param, state in optimizer.state.items():
+                    for key, val in state.items():
+                        if param in saved:
+                            if torch.is_tensor(val):
+                                val.copy_(saved[param][key])
+                            else:
+                                state[key] = saved[param][key]
+                        elif torch.is_tensor(val):
+                            # created by the warm up. The Adam states start from zeros.
+                            val.zero_()
+
+    def capture_cuda_graph(self, update_actor):
+        """
+        Capture train_on_batch_torch on the static batch. The warm up iterations are undone before the capture,
+        so they don't count as updates.
+        """
+        snapshot = self.snapshot_train_state()
+        stream = torch.cuda.Stream()
+        stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(stream):
+            for _ in range(3):
+                self.train_on_batch_torch(self.static_data, update_actor)
+        torch.cuda.current_stream().wait_stream(stream)
+        self.restore_train_state(snapshot)
+
+        # the Q-only and the full update graphs never replay concurrently, so they share the memory pool
+        pool = next(iter(self.cuda_graphs.values()))[0].pool() if len(self.cuda_graphs) > 0 else None
+        graph = torch.cuda.CUDAGraph()
+        with torch.cuda.graph(graph, pool=pool):
+            static_info = self.train_on_batch_torch(self.static_data, update_actor)
+        self.cuda_graphs[update_actor] = (graph, static_info)
+
+    def train_on_batch_cuda_graph(self, data, update_actor):
+        if self.static_data is None:
+            self.static_data = {key: torch.empty_like(d) for key, d in data.items()}
+        assert data.keys() == self.static_data.keys()
+        for key, d in data.items():
+            assert d.shape == self.static_data[key].shape, 'cuda_graph requires a fixed batch shape'
+            self.static_data[key].copy_(d, non_blocking=True)
+        if update_actor not in self.cuda_graphs:
+            self.capture_cuda_graph(update_actor)
+        graph, static_info = self.cuda_graphs[update_actor]
+        graph.replay()
+        # the static outputs are overwritten by the next replay
+        return {key: val.clone() for key, val in static_info.items()}
+
     def train_on_batch(self, data):
-        new_data = ptu.convert_dict_to_tensor(data, device=self.device)
-        info = self.train_q_network_on_batch_torch(**new_data)
+        new_data = self.convert_dict_to_tensor(data)
 
         self.policy_updates += 1
+        update_actor = self.policy_updates % self.policy_update_freq == 0
 
-        if self.policy_updates % self.policy_update_freq == 0:
-            obs = new_data['obs']
-            actor_info = self.train_actor_on_batch_torch(obs)
-            info.update(actor_info)
-            self.update_target()
+        if self.cuda_graph:
+            info = self.train_on_batch_cuda_graph(new_data, update_actor)
+        else:
+            info = self.train_on_batch_torch(new_data, update_actor)
 
         if self.logger is not None:
             self.logger.store(**info)
@@ -173,26 +304,32 @@ class TD3Agent(nn.Module, OffPolicyAgent):
         return info
 
     def act_batch_torch(self, obs):
-        with torch.no_grad():
+        with torch.inference_mode():
             pi_final = self.policy_net(obs)
-            noise = torch.randn_like(pi_final) * self.actor_noise
-            pi_final = pi_final + noise
-            pi_final = torch.clip(pi_final, -self.act_lim, self.act_lim)
+            pi_final = rlu.functional.add_clipped_noise(pi_final, self.actor_noise, math.inf, self.act_lim)
             return pi_final
 
+    def obs_to_tensor(self, obs):
+        if not ptu.is_cuda_device(self.device):
+            return torch.as_tensor(obs, dtype=torch.float32, device=self.device)
+        obs = torch.from_numpy(np.asarray(obs))
+        if self.act_obs_buf is None or self.act_obs_buf.shape[0] < obs.shape[0]:
+            self.act_obs_buf = torch.empty(size=obs.shape, dtype=torch.float32, device=self.device)
+        obs_buf = self.act_obs_buf[:obs.shape[0]]
+        obs_buf.copy_(obs)
+        return obs_buf
+
     def act_batch_test(self, obs):
-        obs = torch.as_tensor(obs, dtype=torch.float32, device=self.device)
-        with torch.no_grad():
+        obs = self.obs_to_tensor(obs)
+        with torch.inference_mode():
             result = self.policy_net(obs)
             return ptu.to_numpy(result)
 
     def act_batch_explore(self, obs, global_steps):
-        obs = torch.as_tensor(obs, dtype=torch.float32, device=self.device)
-        with torch.no_grad():
+        obs = self.obs_to_tensor(obs)
+        with torch.inference_mode():
             pi_final = self.policy_net(obs)
-            noise = torch.randn_like(pi_final) * self.actor_noise
-            pi_final = pi_final + noise
-            pi_final = torch.clip(pi_final, -self.act_lim, self.act_lim)
+            pi_final = rlu.functional.add_clipped_noise(pi_final, self.actor_noise, math.inf, self.act_lim)
             return ptu.to_numpy(pi_final)
 
 
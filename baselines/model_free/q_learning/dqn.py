@@ -51,6 +51,7 @@ class DQN(OffPolicyAgent, nn.Module):
 
         self.policy_updates = 0
         self.to(self.device)
+        self.convert_dict_to_tensor = ptu.PinnedDictConverter(self.device)
 
     def reset_optimizer(self):
         self.q_optimizer = torch.optim.Adam(self.q_network.parameters(), lr=self.q_lr)
@@ -98,7 +99,7 @@ class DQN(OffPolicyAgent, nn.Module):
         return info
 
     def train_on_batch(self, data):
-        tensor_data = ptu.convert_dict_to_tensor(data, device=self.device)
+        tensor_data = self.convert_dict_to_tensor(data)
 
         info = self.train_on_batch_torch(**tensor_data)
         self.policy_updates += 1
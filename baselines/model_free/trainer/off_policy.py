@@ -20,6 +20,7 @@ def run_offpolicy(env_name: str,
                   make_agent_fn: Callable = None,
                   # replay buffer
                   replay_size=1000000,
+                  replay_store_dtype: str = None,
                   n_steps=1,
                   gamma=0.99,
                   # runner args
@@ -31,6 +32,7 @@ def run_offpolicy(env_name: str,
                   update_every=1,
                   update_per_step=1,
                   batch_size=256,
+                  prefetch=0,
                   seed=1,
                   logger_path: str = None,
                   backend: Union[str, None] = None
@@ -66,13 +68,18 @@ def run_offpolicy(env_name: str,
 
     env.action_space.seed(seeder.generate_seed())
 
-    # replay buffer
+    # replay buffer. Agents converting batches with a PinnedDictConverter upcast the reduced precision keys
+    # on the device, so the buffer skips the cast on the host and the H2D copy moves half the bytes.
+    upcast_on_device = getattr(getattr(agent, 'convert_dict_to_tensor', None), 'upcast_dtype', None) is not None
     replay_buffer = ReplayBuffer.from_env(env=env_fn(), capacity=replay_size,
                                           seed=seeder.generate_seed(),
-                                          memory_efficient=False)
+                                          memory_efficient=False,
+                                          store_dtype=replay_store_dtype,
+                                          cast_on_read=not upcast_on_device)
 
     # setup sampler
     sampler = rl_infra.samplers.BatchSampler(env=env, n_steps=n_steps, gamma=gamma,
+                                             reward_scale=getattr(agent, 'reward_scale', 1.0),
                                              seed=seeder.generate_seed())
 
     # setup tester
@@ -85,35 +92,47 @@ def run_offpolicy(env_name: str,
     sampler.set_logger(logger=logger)
     tester.set_logger(logger=logger)
 
+    # prefetch > 0 samples the minibatches in a background thread, overlapping the gather with train_on_batch.
+    # The prefetched minibatches depend on the thread timing, so seeded runs are not reproducible.
+    updater = rl_infra.OffPolicyUpdater(agent=agent, replay_buffer=replay_buffer, update_per_step=update_per_step,
+                                        update_every=update_every, update_after=update_after,
+                                        batch_size=batch_size, prefetch=prefetch)
+
     sampler.reset()
     timer.start()
     global_step = 0
     policy_updates = 0
 
+    # created once instead of every env step. explore_fn reads the current global_step
+    random_fn = lambda o: np.asarray(env.action_space.sample())
+    explore_fn = lambda obs: agent.act_batch_explore(obs, global_step)
+
     for epoch in range(1, epochs + 1):
         for t in trange(steps_per_epoch, desc=f'Epoch {epoch}/{epochs}'):
             if sampler.total_env_steps < start_steps:
                 sampler.sample(num_steps=1,
-                               collect_fn=lambda o: np.asarray(env.action_space.sample()),
+                               collect_fn=random_fn,
                                replay_buffer=replay_buffer)
             else:
                 sampler.sample(num_steps=1,
-                               collect_fn=lambda obs: agent.act_batch_explore(obs, global_step),
+                               collect_fn=explore_fn,
                                replay_buffer=replay_buffer)
             # Update handling
             if global_step > update_after:
                 if global_step % update_every == 0:
-                    for _ in range(int(update_per_step * update_every)):
-                        batch = replay_buffer.sample(batch_size)
+                    num_updates = int(update_per_step * update_every)
+                    for batch in updater.get_batches(num_updates):
                         agent.train_on_batch(data=batch)
                         policy_updates += 1
 
             global_step += 1
 
-        tester.test_agent(get_action=lambda obs: agent.act_batch_test(obs),
+        tester.test_agent(get_action=agent.act_batch_test,
                           name=agent.__class__.__name__,
                           num_test_episodes=num_test_episodes)
         # Log info about epoch
         logger.log_tabular('Epoch', epoch)
         logger.log_tabular('PolicyUpdates', policy_updates)
         logger.dump_tabular()
+
+    updater.close()
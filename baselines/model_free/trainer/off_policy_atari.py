@@ -84,6 +84,7 @@ def run_offpolicy_atari(env_name: str,
 
     # setup sampler
     sampler = rl_infra.samplers.BatchFrameStackSampler(env=env, n_steps=n_steps, gamma=gamma,
+                                                       reward_scale=getattr(agent, 'reward_scale', 1.0),
                                                        seed=seeder.generate_seed(),
                                                        num_stack=num_stack)
 
@@ -104,27 +105,33 @@ def run_offpolicy_atari(env_name: str,
     global_step = 0
     policy_updates = 0
 
+    # created once instead of every env step. explore_fn reads the current global_step
+    random_fn = lambda o: np.asarray(env.action_space.sample())
+    explore_fn = lambda obs: agent.act_batch_explore(obs, global_step)
+
     for epoch in range(1, epochs + 1):
         for t in trange(steps_per_epoch, desc=f'Epoch {epoch}/{epochs}'):
             if sampler.total_env_steps < start_steps:
                 sampler.sample(num_steps=1,
-                               collect_fn=lambda o: np.asarray(env.action_space.sample()),
+                               collect_fn=random_fn,
                                replay_buffer=replay_buffer)
             else:
                 sampler.sample(num_steps=1,
-                               collect_fn=lambda obs: agent.act_batch_explore(obs, global_step),
+                               collect_fn=explore_fn,
                                replay_buffer=replay_buffer)
             # Update handling
             if global_step > update_after:
                 if global_step % update_every == 0:
-                    for _ in range(int(update_per_step * update_every)):
-                        batch = replay_buffer.sample(batch_size)
+                    num_updates = int(update_per_step * update_every)
+                    batches = replay_buffer.sample_many(num_updates, batch_size)
+                    for i in range(num_updates):
+                        batch = {key: item[i] for key, item in batches.items()}
                         agent.train_on_batch(data=batch)
                         policy_updates += 1
 
             global_step += 1
 
-        tester.test_agent(get_action=lambda obs: agent.act_batch_test(obs),
+        tester.test_agent(get_action=agent.act_batch_test,
                           name=agent.__class__.__name__,
                           num_test_episodes=num_test_episodes)
         # Log info about epoch
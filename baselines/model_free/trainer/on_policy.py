@@ -79,7 +79,7 @@ def run_onpolicy(env_name,
         data = replay_buffer.get()
         agent.train_on_batch(data=data)
 
-        tester.test_agent(get_action=lambda obs: agent.act_batch_test(obs),
+        tester.test_agent(get_action=agent.act_batch_test,
                           name=agent.__class__.__name__,
                           num_test_episodes=num_test_episodes)
 
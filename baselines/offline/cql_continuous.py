@@ -67,6 +67,7 @@ class CQLContinuousAgent(Agent, nn.Module):
 
         self.device = device
         self.to(self.device)
+        self.convert_dict_to_tensor = ptu.PinnedDictConverter(self.device)
 
     def log_tabular(self):
         self.logger.log_tabular('Q1Vals', with_min_and_max=True)
@@ -117,7 +118,7 @@ class CQLContinuousAgent(Agent, nn.Module):
         # max_a Q(s,a)
         with torch.no_grad():
             obs_tile = torch.tile(obs, (self.num_samples, 1))
-            actions, log_prob, _, _ = self.policy_net((obs_tile, False))  # (num_samples * None, act_dim)
+            actions, log_prob, _ = self.policy_net((obs_tile, False))  # (num_samples * None, act_dim)
         cql_q_values_pi = self.q_network((obs_tile, actions), training=False) - log_prob  # (num_samples * None)
         cql_q_values_pi = torch.reshape(cql_q_values_pi, shape=(self.num_samples, batch_size))
 
@@ -150,7 +151,7 @@ class CQLContinuousAgent(Agent, nn.Module):
             log_prob_data, log_prob = self.policy_net.compute_log_prob((obs, act))
             policy_loss = torch.mean(log_prob * alpha - log_prob_data, dim=0)
         else:
-            action, log_prob, _, _ = self.policy_net((obs, False))
+            action, log_prob, _ = self.policy_net((obs, False))
             q_values_pi_min = self.q_network((obs, action), training=False)
             policy_loss = torch.mean(log_prob * alpha - q_values_pi_min, dim=0)
 
@@ -178,7 +179,7 @@ class CQLContinuousAgent(Agent, nn.Module):
         return info
 
     def train_on_batch(self, data, behavior_cloning=False):
-        data = ptu.convert_dict_to_tensor(data, self.device)
+        data = self.convert_dict_to_tensor(data)
         info = self.train_nets_cql_pytorch(**data, behavior_cloning=behavior_cloning)
         self.update_target()
         self.logger.store(**info)
@@ -191,7 +192,7 @@ class CQLContinuousAgent(Agent, nn.Module):
         return self.act_batch_test_pytorch(obs).cpu().numpy()
 
     def act_batch_test_pytorch(self, obs):
-        with torch.no_grad():
+        with torch.inference_mode():
             batch_size = obs.shape[0]
             obs_tile = torch.tile(obs, (self.num_samples, 1))
             actions = self.policy_net.select_action((obs_tile, False))  # (num_samples * None, act_dim)
@@ -257,11 +258,11 @@ def run_d4rl_cql(env_name: str,
 
     import d4rl
     dataset = d4rl.qlearning_dataset(env)
-    dataset['obs'] = dataset.pop('observations').astype(np.float32)
-    dataset['act'] = dataset.pop('actions').astype(np.float32)
-    dataset['next_obs'] = dataset.pop('next_observations').astype(np.float32)
-    dataset['rew'] = dataset.pop('rewards').astype(np.float32)
-    dataset['done'] = dataset.pop('terminals').astype(np.float32)
+    dataset['obs'] = dataset.pop('observations').astype(np.float32, copy=False)
+    dataset['act'] = dataset.pop('actions').astype(np.float32, copy=False)
+    dataset['next_obs'] = dataset.pop('next_observations').astype(np.float32, copy=False)
+    dataset['rew'] = dataset.pop('rewards').astype(np.float32, copy=False)
+    dataset['done'] = dataset.pop('terminals').astype(np.float32, copy=False)
 
     agent = CQLContinuousAgent(env=env, policy_lr=policy_lr, policy_mlp_hidden=policy_mlp_hidden,
                                q_mlp_hidden=q_mlp_hidden, q_lr=q_lr, alpha=alpha,
@@ -300,7 +301,7 @@ def run_d4rl_cql(env_name: str,
             agent.train_on_batch(data=batch, behavior_cloning=policy_updates < behavior_cloning_steps)
             policy_updates += 1
 
-        tester.test_agent(get_action=lambda obs: agent.act_batch_test(obs),
+        tester.test_agent(get_action=agent.act_batch_test,
                           name=agent.__class__.__name__,
                           num_test_episodes=num_test_episodes)
         # Log info about epoch
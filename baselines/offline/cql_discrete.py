@@ -46,6 +46,7 @@ class CQLDiscreteAgent(Agent, nn.Module):
 
         self.device = device
         self.to(self.device)
+        self.convert_dict_to_tensor = ptu.PinnedDictConverter(self.device)
 
     def log_tabular(self):
         self.logger.log_tabular('QVals', with_min_and_max=True)
@@ -108,7 +109,7 @@ class CQLDiscreteAgent(Agent, nn.Module):
         return info
 
     def train_on_batch(self, data):
-        data = ptu.convert_dict_to_tensor(data, self.device)
+        data = self.convert_dict_to_tensor(data)
         info = self.train_nets_cql_pytorch(**data)
         self.update_target()
         self.logger.store(**info)
@@ -199,11 +200,11 @@ def run_atari_cql(env_name: str,
 
     import d4rl
     dataset = d4rl.qlearning_dataset(env)
-    dataset['obs'] = dataset.pop('observations').astype(np.float32)
-    dataset['act'] = dataset.pop('actions').astype(np.float32)
-    dataset['next_obs'] = dataset.pop('next_observations').astype(np.float32)
-    dataset['rew'] = dataset.pop('rewards').astype(np.float32)
-    dataset['done'] = dataset.pop('terminals').astype(np.float32)
+    dataset['obs'] = dataset.pop('observations').astype(np.float32, copy=False)
+    dataset['act'] = dataset.pop('actions').astype(np.float32, copy=False)
+    dataset['next_obs'] = dataset.pop('next_observations').astype(np.float32, copy=False)
+    dataset['rew'] = dataset.pop('rewards').astype(np.float32, copy=False)
+    dataset['done'] = dataset.pop('terminals').astype(np.float32, copy=False)
 
     def make_q_net(env):
         net = rlu.nn.values.LazyAtariDuelQModule(action_dim=env.action_space.n)
@@ -248,7 +249,7 @@ def run_atari_cql(env_name: str,
             agent.train_on_batch(data=batch)
             policy_updates += 1
 
-        tester.test_agent(get_action=lambda obs: agent.act_batch_test(obs),
+        tester.test_agent(get_action=agent.act_batch_test,
                           name=agent.__class__.__name__,
                           num_test_episodes=num_test_episodes)
         # Log info about epoch
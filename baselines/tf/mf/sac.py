@@ -29,8 +29,14 @@ class SACAgent(Agent, tf.keras.Model):
                  auto_alpha=True,
                  exploration_bonus=True,
                  target_policy=False,
+                 mixed_precision=False,
                  ):
         super(SACAgent, self).__init__()
+        self.mixed_precision = mixed_precision
+        # the networks are built under the mixed_float16 policy. Their output layers are kept in float32.
+        global_policy = tf.keras.mixed_precision.global_policy()
+        if self.mixed_precision:
+            tf.keras.mixed_precision.set_global_policy('mixed_float16')
         self.obs_spec = obs_spec
         self.act_spec = act_spec
         self.act_dim = self.act_spec.shape[0]
@@ -49,12 +55,16 @@ class SACAgent(Agent, tf.keras.Model):
                                                            num_ensembles=num_ensembles)
         else:
             raise NotImplementedError
+        tf.keras.mixed_precision.set_global_policy(global_policy)
         rlu.functional.hard_update(self.target_q_network, self.q_network)
         if self.target_policy_net is not None:
             rlu.functional.hard_update(self.target_policy_net, self.policy_net)
 
         self.policy_optimizer = tf.keras.optimizers.Adam(lr=policy_lr)
         self.q_optimizer = tf.keras.optimizers.Adam(lr=q_lr)
+        if self.mixed_precision:
+            self.policy_optimizer = tf.keras.mixed_precision.LossScaleOptimizer(self.policy_optimizer)
+            self.q_optimizer = tf.keras.mixed_precision.LossScaleOptimizer(self.q_optimizer)
 
         self.log_alpha = rlu.nn.LagrangeLayer(initial_value=alpha)
         self.alpha_optimizer = tf.keras.optimizers.Adam(lr=alpha_lr)
@@ -75,11 +85,11 @@ class SACAgent(Agent, tf.keras.Model):
         self.logger.log_tabular('Alpha', average_only=True)
         self.logger.log_tabular('LossAlpha', average_only=True)
 
-    @tf.function
+    @tf.function(jit_compile=True)
     def update_target_policy(self):
         rlu.functional.soft_update(self.target_policy_net, self.policy_net, self.tau)
 
-    @tf.function
+    @tf.function(jit_compile=True)
     def update_target_q(self):
         rlu.functional.soft_update(self.target_q_network, self.q_network, self.tau)
 
@@ -95,7 +105,7 @@ class SACAgent(Agent, tf.keras.Model):
             next_q_values = next_q_values - alpha * next_action_log_prob
         return next_q_values
 
-    @tf.function
+    @tf.function(jit_compile=True)
     def _update_q_nets(self, obs, act, next_obs, done, rew, weights=None):
         # compute target Q values
         next_q_values = self._compute_next_obs_q(next_obs)
@@ -112,8 +122,14 @@ class SACAgent(Agent, tf.keras.Model):
             q_values_loss = tf.reduce_mean(q_values_loss, axis=-1)
             # (num_ensembles, None)
             q_values_loss = tf.reduce_sum(q_values_loss, axis=0)
+            if self.mixed_precision:
+                scaled_q_values_loss = self.q_optimizer.get_scaled_loss(q_values_loss)
 
-        q_gradients = q_tape.gradient(q_values_loss, self.q_network.trainable_variables)
+        if self.mixed_precision:
+            q_gradients = q_tape.gradient(scaled_q_values_loss, self.q_network.trainable_variables)
+            q_gradients = self.q_optimizer.get_unscaled_gradients(q_gradients)
+        else:
+            q_gradients = q_tape.gradient(q_values_loss, self.q_network.trainable_variables)
         self.q_optimizer.apply_gradients(zip(q_gradients, self.q_network.trainable_variables))
 
         self.update_target_q()
@@ -128,7 +144,7 @@ class SACAgent(Agent, tf.keras.Model):
             info[f'Q{i + 1}Vals'] = q_values[i]
         return info
 
-    @tf.function
+    @tf.function(jit_compile=True)
     def _update_actor(self, obs, weights=None):
         alpha = self.log_alpha()
         # policy loss
@@ -139,7 +155,13 @@ class SACAgent(Agent, tf.keras.Model):
             if weights is not None:
                 policy_loss = policy_loss * weights
             policy_loss = tf.reduce_mean(policy_loss, axis=0)
-        policy_gradients = policy_tape.gradient(policy_loss, self.policy_net.trainable_variables)
+            if self.mixed_precision:
+                scaled_policy_loss = self.policy_optimizer.get_scaled_loss(policy_loss)
+        if self.mixed_precision:
+            policy_gradients = policy_tape.gradient(scaled_policy_loss, self.policy_net.trainable_variables)
+            policy_gradients = self.policy_optimizer.get_unscaled_gradients(policy_gradients)
+        else:
+            policy_gradients = policy_tape.gradient(policy_loss, self.policy_net.trainable_variables)
         self.policy_optimizer.apply_gradients(zip(policy_gradients, self.policy_net.trainable_variables))
 
         # log alpha
@@ -168,6 +190,8 @@ class SACAgent(Agent, tf.keras.Model):
 
     def train_on_batch(self, data, **kwargs):
         update_target = data.pop('update_target')
+        # convert once, so that the Q and the actor updates don't convert obs separately
+        data = {key: tf.convert_to_tensor(val) for key, val in data.items()}
         obs = data['obs']
         info = self._update_q_nets(**data)
         if update_target:
@@ -176,25 +200,29 @@ class SACAgent(Agent, tf.keras.Model):
         self.logger.store(**rlu.functional.to_numpy_or_python_type(info))
         return info
 
-    @tf.function
+    @tf.function(jit_compile=True)
     def act_batch_explore_tf(self, obs):
         print(f'Tracing sac act_batch with obs {obs}')
         pi_final = self.policy_net((obs, tf.constant(False)))[0]
         return pi_final
 
-    @tf.function
+    @tf.function(jit_compile=True)
     def act_batch_test_tf(self, obs):
         pi_final = self.policy_net((obs, tf.constant(True)))[0]
         return pi_final
 
-    @tf.function
+    @tf.function(jit_compile=True)
     def act_batch_test_tf_v2(self, obs):
         n = 20
         batch_size = tf.shape(obs)[0]
+        # run the policy once and draw n samples from its distribution instead of tiling obs through the policy
+        params = self.policy_net.net(obs)
+        pi_distribution = self.policy_net.pi_dist_layer(params)
+        action = self.policy_net.transform_raw_action(pi_distribution.sample(n))  # (n, batch_size, act_dim)
+        # the Q network takes one observation per action
         obs = tf.tile(obs, (n, 1))
-        action = self.policy_net((obs, tf.constant(False)))[0]
-        q_values_pi_min = self.q_network((obs, action), training=True)[0, :]
-        action = tf.reshape(action, shape=(n, batch_size, self.act_dim))
+        q_values_pi_min = self.q_network((obs, tf.reshape(action, shape=(n * batch_size, self.act_dim))),
+                                         training=True)[0, :]
         idx = tf.argmax(tf.reshape(q_values_pi_min, shape=(n, batch_size)), axis=0,
                         output_type=tf.int32)  # (batch_size)
         idx = tf.stack([idx, tf.range(batch_size)], axis=-1)
@@ -15,12 +15,33 @@ import tensorflow as tf
 import tensorflow_probability as tfp
 from rlutils.infra.runner import TFRunner
 from rlutils.logx import EpochLogger
-from rlutils.replay_buffers import PyUniformReplayBuffer
 from tqdm.auto import tqdm, trange
 
 tfd = tfp.distributions
 
 
+class TFUniformReplayBuffer(object):
+    """ A static replay buffer that keeps each field as a contiguous tensor on device (column-major),
+    so that sampling a batch is a single uniform draw followed by one gather per field.
+    """
+
+    def __init__(self, data, batch_size):
+        self.data = {key: tf.Variable(val, trainable=False) for key, val in data.items()}
+        self.batch_size = batch_size
+        self.size = list(data.values())[0].shape[0]
+
+    def __len__(self):
+        return self.size
+
+    def get(self):
+        return self.data
+
+    @tf.function
+    def sample(self):
+        idx = tf.random.uniform(shape=[self.batch_size], minval=0, maxval=self.size, dtype=tf.int32)
+        return {key: tf.gather(val, idx) for key, val in self.data.items()}
+
+
 class BRACPAgent(tf.keras.Model):
     def __init__(self,
                  ob_dim,
@@ -47,6 +68,8 @@ class BRACPAgent(tf.keras.Model):
                  entropy_reg=True,
                  kl_backup=False,
                  max_ood_grad_norm=0.01,
+                 mixed_precision=False,
+                 target_update_interval=1,
                  ):
         super(BRACPAgent, self).__init__()
         self.reg_type = reg_type
@@ -62,13 +85,24 @@ class BRACPAgent(tf.keras.Model):
                                                              obs_dim=self.ob_dim, act_dim=self.ac_dim,
                                                              mlp_hidden=behavior_mlp_hidden)
         self.behavior_lr = behavior_lr
+        # the policy and Q networks are built under the mixed_bfloat16 policy. Their output layers, the behavior
+        # policy and the Lagrange multipliers are kept in float32, so the KL and the losses are computed in float32.
+        self.mixed_precision = mixed_precision
+        global_policy = tf.keras.mixed_precision.global_policy()
+        if self.mixed_precision:
+            tf.keras.mixed_precision.set_global_policy('mixed_bfloat16')
         self.policy_net = rlu.nn.SquashedGaussianMLPActor(ob_dim, ac_dim, policy_mlp_hidden)
         self.target_policy_net = rlu.nn.SquashedGaussianMLPActor(ob_dim, ac_dim, policy_mlp_hidden)
-        self.policy_net.optimizer = rlu.future.get_adam_optimizer(lr=self.policy_lr)
-        rlu.functional.hard_update(self.target_policy_net, self.policy_net)
         self.q_network = rlu.nn.EnsembleMinQNet(ob_dim, ac_dim, q_mlp_hidden)
-        self.q_network.compile(optimizer=rlu.future.get_adam_optimizer(q_lr))
         self.target_q_network = rlu.nn.EnsembleMinQNet(ob_dim, ac_dim, q_mlp_hidden)
+        tf.keras.mixed_precision.set_global_policy(global_policy)
+        # optimizers of the policy and log_beta after pretraining. They are created once and swapped in by
+        # set_policy_net_optimizer instead of being rebuilt every time the training phase (re)starts.
+        self.policy_optimizer = rlu.future.get_adam_optimizer(lr=self.policy_lr)
+        self.log_beta_optimizer = rlu.future.get_adam_optimizer(lr=1e-3)
+        self.policy_net.optimizer = self.policy_optimizer
+        rlu.functional.hard_update(self.target_policy_net, self.policy_net)
+        self.q_network.compile(optimizer=rlu.future.get_adam_optimizer(q_lr))
         rlu.functional.hard_update(self.target_q_network, self.q_network)
 
         self.log_beta = rlu.nn.LagrangeLayer(initial_value=alpha)
@@ -84,6 +118,10 @@ class BRACPAgent(tf.keras.Model):
 
         self.tau = tau
         self.gamma = gamma
+        # update the targets every target_update_interval steps with the equivalent cumulative tau
+        self.target_update_interval = target_update_interval
+        self.target_tau = 1. - (1. - tau) ** target_update_interval
+        self.target_update_counter = tf.Variable(initial_value=0, trainable=False, dtype=tf.int64)
 
         self.kl_n = 5
         self.n = n
@@ -100,6 +138,11 @@ class BRACPAgent(tf.keras.Model):
         self.delta_behavior = tf.Variable(initial_value=0.0, trainable=False, dtype=tf.float32)
         self.delta_gp = tf.Variable(initial_value=0.0, trainable=False, dtype=tf.float32)
         self.reward_scale_factor = 1.0
+        # boolean flags captured by the tf.functions instead of converting a Python bool on every call
+        self._true = tf.constant(True)
+        self._false = tf.constant(False)
+        # running sums of the pretraining statistics, so that they are only fetched once per epoch
+        self.pretrain_stats = tf.Variable(initial_value=tf.zeros(shape=(2,)), trainable=False)
 
     def get_alpha(self, obs):
         return self.log_alpha(obs)
@@ -138,69 +181,107 @@ class BRACPAgent(tf.keras.Model):
         self.logger.log_tabular('GPWeight', average_only=True)
 
     @tf.function
+    def _soft_update_target(self, tau):
+        rlu.functional.soft_update(self.target_q_network, self.q_network, tau)
+        rlu.functional.soft_update(self.target_policy_net, self.policy_net, tau)
+
     def update_target(self):
-        rlu.functional.soft_update(self.target_q_network, self.q_network, self.tau)
-        rlu.functional.soft_update(self.target_policy_net, self.policy_net, self.tau)
+        if self.target_update_interval == 1:
+            self._soft_update_target(self.tau)
+        else:
+            def true_fn():
+                self._soft_update_target(self.target_tau)
+                return tf.constant(True)
+
+            self.target_update_counter.assign_add(1)
+            tf.cond(self.target_update_counter % self.target_update_interval == 0,
+                    true_fn=true_fn, false_fn=lambda: tf.constant(False))
 
     @tf.function
     def hard_update_policy_target(self):
         rlu.functional.hard_update(self.target_policy_net, self.policy_net)
 
-    @tf.function(experimental_relax_shapes=True)
+    def _sample_policy_n(self, policy_net, obs, n):
+        """ Equivalent to policy_net((tf.tile(obs, (n, 1)), False)), but the policy network only runs on
+        (None, obs_dim) and the n samples are drawn from the resulting distribution.
+        Returns: action, log_prob, raw_action of shape (n * None, ...) and the distribution tiled to (n * None,)
+        """
+        params = policy_net.net(obs)
+        pi_distribution = policy_net.pi_dist_layer(params)
+        raw_action = pi_distribution.sample(n)  # (n, None, ac_dim)
+        log_prob = policy_net.transform_raw_log_prob(pi_distribution.log_prob(raw_action), raw_action)  # (n, None)
+        action = policy_net.transform_raw_action(raw_action)
+        raw_action = tf.reshape(raw_action, shape=(-1, self.ac_dim))
+        action = tf.reshape(action, shape=(-1, self.ac_dim))
+        log_prob = tf.reshape(log_prob, shape=(-1,))
+        pi_distribution = tfd.Independent(distribution=tfd.Normal(
+            loc=tf.tile(pi_distribution.distribution.loc, (n, 1)),
+            scale=tf.tile(pi_distribution.distribution.scale, (n, 1))
+        ), reinterpreted_batch_ndims=1)  # (n * None)
+        return action, log_prob, raw_action, pi_distribution
+
+    @staticmethod
+    def _mean_over_tiles(t, n):
+        """ Average over the n copies of each sample. t is (n * None, ...) and in the tf.tile(x, (n, 1)) order,
+        i.e., [b0, b1, ..., b0, b1, ...]. All the n-sample tensors in this agent are built in this order.
+        """
+        return tf.reduce_mean(tf.reshape(t, shape=(n, -1)), axis=0)
+
+    @tf.function(reduce_retracing=True)
     def compute_pi_pib_distance(self, obs):
         if self.reg_type in ['kl', 'cross_entropy']:
-            _, log_prob, raw_action, pi_distribution = self.policy_net((obs, False))
+            _, log_prob, raw_action, pi_distribution = self.policy_net((obs, self._false))
             loss = self._compute_kl_behavior_v2(obs, raw_action, pi_distribution)
         elif self.reg_type == 'mmd':
-            batch_size = tf.shape(obs)[0]
+            action, log_prob, _, pi_distribution = self._sample_policy_n(self.policy_net, obs, self.n)
             obs = tf.tile(obs, (self.n, 1))
-            _, log_prob, raw_action, pi_distribution = self.policy_net((obs, False))
-            loss = self._compute_mmd(obs, raw_action, pi_distribution)
-            log_prob = tf.reduce_mean(tf.reshape(log_prob, shape=(self.n, batch_size)), axis=0)
+            loss = self._compute_mmd(obs, action, pi_distribution)
+            log_prob = self._mean_over_tiles(log_prob, self.n)
         else:
             raise NotImplementedError
         return loss, log_prob
 
+    def _pairwise_l1_distance(self, samples1, samples2):
+        """ L1 distance between all the pairs of samples. (n, None, ac_dim) -> (n, n, None)
+        The sum is accumulated over the action dimension (unrolled at trace time) instead of materializing
+        the (n, n, None, ac_dim) differences.
+        """
+        distance = 0.
+        for i in range(self.ac_dim):
+            distance += tf.abs(tf.expand_dims(samples1[:, :, i], axis=0) - tf.expand_dims(samples2[:, :, i], axis=1))
+        return distance
+
     def mmd_loss_laplacian(self, samples1, samples2, sigma=0.2):
         """MMD constraint with Laplacian kernel for support matching"""
         # sigma is set to 10.0 for hopper, cheetah and 20 for walker/ant
         # (n, None, ac_dim)
-        diff_x_x = tf.expand_dims(samples1, axis=0) - tf.expand_dims(samples1, axis=1)  # (n, n, None, ac_dim)
-        diff_x_x = tf.reduce_mean(tf.exp(-tf.reduce_sum(tf.abs(diff_x_x), axis=-1) / (2.0 * sigma)), axis=(0, 1))
+        diff_x_x = self._pairwise_l1_distance(samples1, samples1)  # (n, n, None)
+        diff_x_x = tf.reduce_mean(tf.exp(-diff_x_x / (2.0 * sigma)), axis=(0, 1))
 
-        diff_x_y = tf.expand_dims(samples1, axis=0) - tf.expand_dims(samples2, axis=1)
-        diff_x_y = tf.reduce_mean(tf.exp(-tf.reduce_sum(tf.abs(diff_x_y), axis=-1) / (2.0 * sigma)), axis=(0, 1))
+        diff_x_y = self._pairwise_l1_distance(samples1, samples2)
+        diff_x_y = tf.reduce_mean(tf.exp(-diff_x_y / (2.0 * sigma)), axis=(0, 1))
 
-        diff_y_y = tf.expand_dims(samples2, axis=0) - tf.expand_dims(samples2, axis=1)  # (n, n, None, ac_dim)
-        diff_y_y = tf.reduce_mean(tf.exp(-tf.reduce_sum(tf.abs(diff_y_y), axis=-1) / (2.0 * sigma)), axis=(0, 1))
+        diff_y_y = self._pairwise_l1_distance(samples2, samples2)  # (n, n, None)
+        diff_y_y = tf.reduce_mean(tf.exp(-diff_y_y / (2.0 * sigma)), axis=(0, 1))
         overall_loss = tf.sqrt(diff_x_x + diff_y_y - 2.0 * diff_x_y + 1e-6)  # (None,)
         return overall_loss
 
-    def _compute_mmd(self, obs, raw_action, pi_distribution):
-        # obs: (n * None, obs_dim), raw_actions: (n * None, ac_dim)
-        batch_size = tf.shape(obs)[0] // self.n
-        samples_pi = raw_action
-        samples_pi = tf.tile(samples_pi, (self.behavior_policy.num_ensembles, 1))
-        samples_pi = tf.reshape(samples_pi, shape=(self.behavior_policy.num_ensembles, self.n,
-                                                   batch_size, self.ac_dim))
-        samples_pi = tf.transpose(samples_pi, perm=[1, 0, 2, 3])
-        samples_pi = tf.reshape(samples_pi, shape=(self.n * self.behavior_policy.num_ensembles, batch_size,
-                                                   self.ac_dim))
+    def _compute_mmd(self, obs, action, pi_distribution):
+        # obs: (n * None, obs_dim), action: (n * None, ac_dim), already squashed by the policy
+        # The kernel means are taken over all the sample pairs, so repeating each policy sample once per ensemble
+        # doesn't change the loss. Keep the n policy samples and fold the ensembles of pi_b into the sample axis.
+        samples_pi = tf.reshape(action, shape=(self.n, -1, self.ac_dim))
 
         obs_expand = rlu.functional.expand_ensemble_dim(obs, self.behavior_policy.num_ensembles)
         samples_pi_b = self.behavior_policy.sample(
-            obs_expand, full_path=tf.convert_to_tensor(False))  # (num_ensembles, n * batch_size, d)
-        samples_pi_b = tf.reshape(samples_pi_b, shape=(self.behavior_policy.num_ensembles, self.n,
-                                                       batch_size, self.ac_dim))
-        samples_pi_b = tf.transpose(samples_pi_b, perm=[1, 0, 2, 3])
-        samples_pi_b = tf.reshape(samples_pi_b, shape=(self.n * self.behavior_policy.num_ensembles, batch_size,
-                                                       self.ac_dim))
-
-        samples_pi = tf.clip_by_value(samples_pi, -3., 3.)
+            obs_expand, full_path=self._false)  # (num_ensembles, n * batch_size, d)
+        samples_pi_b = tf.reshape(samples_pi_b, shape=(self.behavior_policy.num_ensembles * self.n, -1, self.ac_dim))
+
+        # reuse the squashed policy samples. tanh is monotonic, so clipping them to tanh(3) is the same as
+        # squashing the raw samples clipped to 3.
+        samples_pi = tf.clip_by_value(samples_pi, -np.tanh(3.), np.tanh(3.))
         samples_pi_b = tf.clip_by_value(samples_pi_b, -3., 3.)
-        samples_pi = tf.tanh(samples_pi)
         samples_pi_b = tf.tanh(samples_pi_b)
-        # samples_pi = self.policy_net.transform_raw_action(samples_pi)
         # samples_pi_b = self.behavior_policy.transform_raw_action(samples_pi_b)
         mmd_loss = self.mmd_loss_laplacian(samples_pi, samples_pi_b, sigma=self.sigma)
         # mmd_loss = tf.reshape(mmd_loss, shape=(self.behavior_policy.num_ensembles, batch_size))
@@ -209,7 +290,6 @@ class BRACPAgent(tf.keras.Model):
 
     def _compute_kl_behavior_v2(self, obs, raw_action, pi_distribution):
         n = self.kl_n
-        batch_size = tf.shape(obs)[0]
         pi_distribution = tfd.Independent(distribution=tfd.Normal(
             loc=tf.tile(pi_distribution.distribution.loc, (n, 1)),
             scale=tf.tile(pi_distribution.distribution.scale, (n, 1))
@@ -223,8 +303,7 @@ class BRACPAgent(tf.keras.Model):
         posterior = self.behavior_policy.encode_distribution(inputs=(x, cond))
         encode_sample = posterior.sample(n)  # (n, num_ensembles, None, z_dim)
         encode_sample = tf.transpose(encode_sample, perm=[1, 0, 2, 3])  # (num_ensembles, n, None, z_dim)
-        encode_sample = tf.reshape(encode_sample, shape=(self.behavior_policy.num_ensembles,
-                                                         n * batch_size,
+        encode_sample = tf.reshape(encode_sample, shape=(self.behavior_policy.num_ensembles, -1,
                                                          self.behavior_policy.latent_dim))
         cond = tf.tile(cond, multiples=(1, n, 1))  # (num_ensembles, n * None, obs_dim)
         beta_distribution = self.behavior_policy.decode_distribution(z=(encode_sample, cond))  # (ensemble, n * None)
@@ -242,13 +321,30 @@ class BRACPAgent(tf.keras.Model):
             raise NotImplementedError
 
         final_kl_loss = kl_loss + posterior_kld  # (ensembles, None * n)
-        final_kl_loss = tf.reshape(final_kl_loss, shape=(self.behavior_policy.num_ensembles, n, batch_size))
+        final_kl_loss = tf.reshape(final_kl_loss, shape=(self.behavior_policy.num_ensembles, n, -1))
         final_kl_loss = tf.reduce_mean(final_kl_loss, axis=[0, 1])  # average both latent and ensemble dimension
         return final_kl_loss
 
-    @tf.function
+    def _compute_distance_n(self, obs_tile, action, raw_action, pi_distribution):
+        """ Distance between pi and pi_b averaged over the n samples of each observation.
+        obs_tile: (n * None, obs_dim), action and raw_action: (n * None, ac_dim). Returns (None,)
+        The branch on reg_type is resolved at trace time.
+        """
+        if self.reg_type in ['kl', 'cross_entropy']:
+            kl_loss = self._compute_kl_behavior_v2(obs_tile, raw_action, pi_distribution)  # (n * None,)
+            return self._mean_over_tiles(kl_loss, self.n)
+        else:
+            return self._compute_mmd(obs_tile, action, pi_distribution)
+
+    @tf.function(reduce_retracing=True)
     def update_actor_first_order(self, obs):
         # TODO: maybe we just follow behavior policy and keep a minimum entropy instead of the optimal one.
+        # the Lagrange multipliers are scalars that don't change until their own update. Evaluate them once and
+        # re-enter their tapes to compute the multiplier losses below.
+        with tf.GradientTape() as alpha_tape:
+            alpha = self.get_alpha(obs)
+        with tf.GradientTape() as beta_tape:
+            beta = self.log_beta(obs)
         # policy loss
         with tf.GradientTape() as policy_tape:
             """ Compute the loss function of the policy that maximizes the Q function """
@@ -256,25 +352,15 @@ class BRACPAgent(tf.keras.Model):
 
             policy_tape.watch(self.policy_net.trainable_variables)
 
-            batch_size = tf.shape(obs)[0]
-            alpha = self.get_alpha(obs)  # (None, act_dim)
-            beta = self.log_beta(obs)
-
             obs_tile = tf.tile(obs, (self.n, 1))
 
             # policy loss
-            action, log_prob, raw_action, pi_distribution = self.policy_net((obs_tile, False))
-            log_prob = tf.reduce_mean(tf.reshape(log_prob, shape=(self.n, batch_size)), axis=0)
+            action, log_prob, raw_action, pi_distribution = self._sample_policy_n(self.policy_net, obs, self.n)
+            log_prob = self._mean_over_tiles(log_prob, self.n)
             q_values_pi_min = self.q_network((obs_tile, action), training=False)
-            q_values_pi_min = tf.reduce_mean(tf.reshape(q_values_pi_min, shape=(self.n, batch_size)), axis=0)
+            q_values_pi_min = self._mean_over_tiles(q_values_pi_min, self.n)
             # add KL divergence penalty, high variance?
-            if self.reg_type in ['kl', 'cross_entropy']:
-                kl_loss = self._compute_kl_behavior_v2(obs_tile, raw_action, pi_distribution)  # (None, act_dim)
-                kl_loss = tf.reduce_mean(tf.reshape(kl_loss, shape=(self.n, batch_size)), axis=0)
-            elif self.reg_type == 'mmd':
-                kl_loss = self._compute_mmd(obs_tile, raw_action, pi_distribution)
-            else:
-                raise NotImplementedError
+            kl_loss = self._compute_distance_n(obs_tile, action, raw_action, pi_distribution)
 
             delta = kl_loss - self.delta_behavior
             penalty = delta * alpha  # (None, act_dim)
@@ -295,9 +381,7 @@ class BRACPAgent(tf.keras.Model):
         rlu.future.minimize(policy_loss, policy_tape, self.policy_net)
 
         if self.entropy_reg:
-            with tf.GradientTape() as beta_tape:
-                beta_tape.watch(self.log_beta.trainable_variables)
-                beta = self.log_beta(obs)
+            with beta_tape:
                 # beta loss
                 if self.reg_type == 'kl':
                     beta_loss = tf.reduce_mean(beta * (log_prob + self.target_entropy))
@@ -309,9 +393,8 @@ class BRACPAgent(tf.keras.Model):
         else:
             beta_loss = 0.
 
-        with tf.GradientTape() as alpha_tape:
+        with alpha_tape:
             # alpha loss
-            alpha = self.get_alpha(obs)
             penalty = delta * alpha
             alpha_loss = -tf.reduce_mean(penalty, axis=0)
 
@@ -330,12 +413,13 @@ class BRACPAgent(tf.keras.Model):
 
         return info
 
-    @tf.function
+    @tf.function(reduce_retracing=True)
     def update_actor_cloning(self, obs):
         """ Minimize KL(pi, pi_b) """
+        with tf.GradientTape() as beta_tape:
+            beta = self.log_beta(obs)
         with tf.GradientTape() as policy_tape:
             policy_tape.watch(self.policy_net.trainable_variables)
-            beta = self.log_beta(obs)
             loss, log_prob = self.compute_pi_pib_distance(obs)
             if self.entropy_reg:
                 if self.reg_type in ['kl']:
@@ -350,9 +434,7 @@ class BRACPAgent(tf.keras.Model):
         rlu.future.minimize(policy_loss, policy_tape, self.policy_net)
 
         if self.entropy_reg:
-            with tf.GradientTape() as beta_tape:
-                beta_tape.watch(self.log_beta.trainable_variables)
-                beta = self.log_beta(obs)
+            with beta_tape:
                 if self.reg_type in ['kl']:
                     beta_loss = tf.reduce_mean(beta * (log_prob + self.target_entropy), axis=0)
                 elif self.reg_type in ['mmd', 'cross_entropy']:
@@ -368,34 +450,27 @@ class BRACPAgent(tf.keras.Model):
         return info
 
     def _compute_target_q(self, next_obs, reward, done):
-        batch_size = tf.shape(next_obs)[0]
         alpha = self.get_alpha(next_obs)
+        next_action, next_action_log_prob, next_raw_action, pi_distribution = self._sample_policy_n(
+            self.target_policy_net, next_obs, self.n)
         next_obs = tf.tile(next_obs, multiples=(self.n, 1))
-        next_action, next_action_log_prob, next_raw_action, pi_distribution = self.target_policy_net((next_obs, False))
         target_q_values = self.target_q_network((next_obs, next_action), training=False)
-        target_q_values = tf.reduce_max(tf.reshape(target_q_values, shape=(self.n, batch_size)), axis=0)
+        target_q_values = tf.reduce_max(tf.reshape(target_q_values, shape=(self.n, -1)), axis=0)
         if self.kl_backup is True:
-            if self.reg_type in ['kl', 'cross_entropy']:
-                kl_loss = self._compute_kl_behavior_v2(next_obs, next_raw_action, pi_distribution)  # (None, act_dim)
-                kl_loss = tf.reduce_mean(tf.reshape(kl_loss, shape=(self.n, batch_size)), axis=0)
-            elif self.reg_type == 'mmd':
-                kl_loss = self._compute_mmd(next_obs, next_raw_action, pi_distribution)
-            else:
-                raise NotImplementedError
+            kl_loss = self._compute_distance_n(next_obs, next_action, next_raw_action, pi_distribution)
             kl_loss = kl_loss / self.reward_scale_factor
             target_q_values = target_q_values - alpha * kl_loss
         q_target = reward + self.gamma * (1.0 - done) * target_q_values
         return q_target
 
     def _compute_q_net_gp(self, obs, actions):
-        batch_size = tf.shape(obs)[0]
         if self.reg_type in ['kl', 'cross_entropy']:
-            pi_action, log_prob, raw_action, pi_distribution = self.policy_net((obs, False))
+            pi_action, log_prob, raw_action, pi_distribution = self.policy_net((obs, self._false))
             kl = self._compute_kl_behavior_v2(obs, raw_action, pi_distribution)  # (None,)
         elif self.reg_type == 'mmd':
+            pi_action, log_prob, raw_action, pi_distribution = self._sample_policy_n(self.policy_net, obs, self.n)
             obs = tf.tile(obs, (self.n, 1))
-            pi_action, log_prob, raw_action, pi_distribution = self.policy_net((obs, False))
-            kl = self._compute_mmd(obs, raw_action, pi_distribution)
+            kl = self._compute_mmd(obs, pi_action, pi_distribution)
         else:
             raise NotImplementedError
 
@@ -403,10 +478,10 @@ class BRACPAgent(tf.keras.Model):
             inner_tape.watch(pi_action)
             q_values = self.q_network((obs, pi_action), training=False)  # (num_ensembles, None)
         input_gradient = inner_tape.gradient(q_values, pi_action)  # (None, act_dim)
-        penalty = tf.norm(input_gradient, axis=-1)  # (None,)
+        # plain elementwise ops that XLA fuses with the weights below. The epsilon keeps the gradient finite at 0.
+        penalty = tf.sqrt(tf.reduce_sum(tf.square(input_gradient), axis=-1) + 1e-12)  # (None,)
         if self.reg_type == 'mmd':
-            penalty = tf.reshape(penalty, shape=(self.n, batch_size))
-            penalty = tf.reduce_mean(penalty, axis=0)
+            penalty = self._mean_over_tiles(penalty, self.n)
         # TODO: consider using soft constraints instead of hard clip
         # weights = tf.nn.sigmoid((kl - self.delta_behavior * 2.) * self.sensitivity)
         if self.gp_type == 'softplus':
@@ -460,15 +535,15 @@ class BRACPAgent(tf.keras.Model):
         )
         return info
 
-    @tf.function
+    @tf.function(reduce_retracing=True)
     def update_q_nets(self, obs, actions, next_obs, done, reward):
         """Normal SAC update"""
         q_target = self._compute_target_q(next_obs, reward, done)
         return self._update_q_nets(obs, actions, q_target)
 
-    @tf.function
-    def _update(self, obs, act, next_obs, done, rew):
-        raw_act = self.behavior_policy.inverse_transform_action(act)
+    @tf.function(jit_compile=True, reduce_retracing=True)
+    def _update(self, obs, act, raw_act, next_obs, done, rew):
+        # the nested tf.functions are inlined, so the behavior, Q, actor and target updates are one XLA cluster
         behavior_loss = self.behavior_policy.train_on_batch(x=(raw_act, obs))['loss']
         info = self.update_q_nets(obs, act, next_obs, done, rew)
         actor_info = self.update_actor_first_order(obs)
@@ -478,24 +553,23 @@ class BRACPAgent(tf.keras.Model):
         info['BehaviorLoss'] = behavior_loss
         return info
 
-    def update(self, replay_buffer: PyUniformReplayBuffer):
+    def update(self, data):
         # TODO: use different batches to update q and actor to break correlation
-        data = replay_buffer.sample()
         info = self._update(**data)
         self.logger.store(**rlu.functional.to_numpy_or_python_type(info))
 
-    @tf.function
+    @tf.function(reduce_retracing=True)
     def act_batch(self, obs, type=5):
         if type == 1:
-            pi_final = self.policy_net((obs, tf.convert_to_tensor(True)))[0]
+            pi_final = self.policy_net((obs, self._true))[0]
             return pi_final
         elif type == 2:
-            pi_final = self.policy_net((obs, tf.convert_to_tensor(False)))[0]
+            pi_final = self.policy_net((obs, self._false))[0]
             return pi_final
         elif type == 3 or type == 4 or type == 5:
             n = 20
             batch_size = tf.shape(obs)[0]
-            pi_distribution = self.policy_net((obs, tf.convert_to_tensor(False)))[-1]
+            pi_distribution = self.policy_net((obs, self._false))[-1]
             samples = pi_distribution.sample(n)  # (n, None, act_dim)
             if type == 4:
                 mean = tf.tile(tf.expand_dims(pi_distribution.mean(), axis=0), (n, 1, 1))
@@ -506,12 +580,12 @@ class BRACPAgent(tf.keras.Model):
                 std = tf.tile(tf.expand_dims(pi_distribution.stddev(), axis=0), (n, 1, 1))
                 samples = tf.clip_by_value(samples, mean - std, mean + std)
             samples = tf.tanh(samples)
-            action = tf.reshape(samples, shape=(n * batch_size, self.ac_dim))
+            action = tf.reshape(samples, shape=(-1, self.ac_dim))
             obs_tile = tf.tile(obs, (n, 1))
 
             q_values_pi_min = self.q_network((obs_tile, action), training=True)
             q_values_pi_min = tf.reduce_mean(q_values_pi_min, axis=0)
-            idx = tf.argmax(tf.reshape(q_values_pi_min, shape=(n, batch_size)), axis=0,
+            idx = tf.argmax(tf.reshape(q_values_pi_min, shape=(n, -1)), axis=0,
                             output_type=tf.int32)  # (batch_size)
             idx = tf.stack([idx, tf.range(batch_size)], axis=-1)
             pi_final = tf.gather_nd(samples, idx)
@@ -536,23 +610,25 @@ class BRACPAgent(tf.keras.Model):
         # reset learning rate
         self.hard_update_policy_target()
         # reset policy net learning rate
-        self.policy_net.optimizer = rlu.future.get_adam_optimizer(lr=self.policy_lr)
-        self.log_beta.optimizer = rlu.future.get_adam_optimizer(lr=1e-3)
+        self.policy_net.optimizer = self.policy_optimizer
+        self.log_beta.optimizer = self.log_beta_optimizer
+
+    @tf.function
+    def _pretrain_cloning_step(self, obs):
+        actor_info = self.update_actor_cloning(obs)
+        self.pretrain_stats.assign_add(tf.stack([tf.reduce_mean(actor_info['KL']),
+                                                 tf.reduce_mean(actor_info['LogPi'])]))
 
     def pretrain_cloning(self, epochs, steps_per_epoch, replay_buffer):
         EpochLogger.log(f'Training cloning policy')
         t = trange(epochs)
         for epoch in t:
-            kl, log_pi = [], []
+            self.pretrain_stats.assign(tf.zeros_like(self.pretrain_stats))
             for _ in trange(steps_per_epoch, desc=f'Epoch {epoch + 1}/{epochs}', leave=False):
                 # update q_b, pi_0, pi_b
                 data = replay_buffer.sample()
-                obs = data['obs']
-                actor_info = self.update_actor_cloning(obs)
-                kl.append(actor_info['KL'])
-                log_pi.append(actor_info['LogPi'])
-            kl = tf.reduce_mean(kl).numpy()
-            log_pi = tf.reduce_mean(log_pi).numpy()
+                self._pretrain_cloning_step(data['obs'])
+            kl, log_pi = self.pretrain_stats.numpy() / steps_per_epoch
             t.set_description(desc=f'KL: {kl:.2f}, LogPi: {log_pi:.2f}')
 
     def set_behavior_policy_optimizer(self, epochs, steps_per_epoch):
@@ -561,26 +637,38 @@ class BRACPAgent(tf.keras.Model):
             lr=self.get_decayed_lr_schedule(lr=self.behavior_lr,
                                             interval=interval))
 
+    @tf.function
+    def _pretrain_behavior_policy_step(self, obs, raw_act):
+        behavior_loss = self.behavior_policy.train_on_batch(x=(raw_act, obs))['loss']
+        self.pretrain_stats.assign_add(tf.stack([behavior_loss, 0.]))
+
     def pretrain_behavior_policy(self, epochs, steps_per_epoch, replay_buffer):
         EpochLogger.log(f'Training behavior policy')
         t = trange(epochs)
         for epoch in t:
-            loss = []
+            self.pretrain_stats.assign(tf.zeros_like(self.pretrain_stats))
             for _ in trange(steps_per_epoch, desc=f'Epoch {epoch + 1}/{epochs}', leave=False):
                 # update q_b, pi_0, pi_b
                 data = replay_buffer.sample()
-                obs = data['obs']
-                raw_act = self.behavior_policy.inverse_transform_action(data['act'])
-                behavior_loss = self.behavior_policy.train_on_batch(x=(raw_act, obs))['loss']
-                loss.append(behavior_loss)
-            loss = tf.reduce_mean(loss).numpy()
+                self._pretrain_behavior_policy_step(data['obs'], data['raw_act'])
+            loss = self.pretrain_stats[0].numpy() / steps_per_epoch
             t.set_description(desc=f'Loss: {loss:.2f}')
 
 
 class BRACPRunner(TFRunner):
+    obs_var = None
+
+    def to_obs_variable(self, o):
+        """ Assign the observations to a persistent variable instead of creating a new EagerTensor per step """
+        o = np.asarray(o, dtype=np.float32)
+        if self.obs_var is None or tuple(self.obs_var.shape) != o.shape:
+            self.obs_var = tf.Variable(initial_value=o, trainable=False, dtype=tf.float32)
+        else:
+            self.obs_var.assign(o)
+        return self.obs_var
+
     def get_action_batch(self, o, deterministic=False):
-        return self.agent.act_batch(tf.convert_to_tensor(o, dtype=tf.float32),
-                                    deterministic).numpy()
+        return self.agent.act_batch(self.to_obs_variable(o), deterministic).numpy()
 
     def test_agent(self, agent, name, deterministic=False, logger=None):
         o, d, ep_ret, ep_len = self.env.reset(), np.zeros(shape=self.num_test_episodes, dtype=np.bool), \
@@ -588,7 +676,7 @@ class BRACPRunner(TFRunner):
                                                                                 dtype=np.int64)
         t = tqdm(total=1, desc=f'Testing {name}')
         while not np.all(d):
-            a = agent.act_batch(tf.convert_to_tensor(o, dtype=tf.float32), 5).numpy()
+            a = agent.act_batch(self.to_obs_variable(o), 5).numpy()
             assert not np.any(np.isnan(a)), f'nan action: {a}'
             o, r, d_, _ = self.env.step(a)
             ep_ret = r * (1 - d) + ep_ret
@@ -607,29 +695,30 @@ class BRACPRunner(TFRunner):
                             batch_size,
                             reward_scale=True):
         import d4rl
-        def rescale(x):
-            return (x - np.min(x)) / (np.max(x) - np.min(x))
 
         self.dummy_env = gym.make(self.env_name)
         dataset = d4rl.qlearning_dataset(env=self.dummy_env)
 
         if reward_scale:
             EpochLogger.log('Using reward scale', color='red')
-            self.agent.reward_scale_factor = np.max(dataset['rewards'] - np.min(dataset['rewards']))
+            rewards = dataset['rewards']
+            reward_min = np.min(rewards)
+            self.agent.reward_scale_factor = np.max(rewards) - reward_min
             EpochLogger.log(f'The scale factor is {self.agent.reward_scale_factor:.2f}')
-            dataset['rewards'] = rescale(dataset['rewards'])
+            # rescale to [0, 1] in place
+            np.subtract(rewards, reward_min, out=rewards)
+            np.divide(rewards, self.agent.reward_scale_factor, out=rewards)
         # modify keys
-        dataset['obs'] = dataset.pop('observations').astype(np.float32)
-        dataset['act'] = dataset.pop('actions').astype(np.float32)
-        dataset['next_obs'] = dataset.pop('next_observations').astype(np.float32)
-        dataset['rew'] = dataset.pop('rewards').astype(np.float32)
-        dataset['done'] = dataset.pop('terminals').astype(np.float32)
+        dataset['obs'] = dataset.pop('observations').astype(np.float32, copy=False)
+        dataset['act'] = dataset.pop('actions').astype(np.float32, copy=False)
+        dataset['next_obs'] = dataset.pop('next_observations').astype(np.float32, copy=False)
+        dataset['rew'] = dataset.pop('rewards').astype(np.float32, copy=False)
+        dataset['done'] = dataset.pop('terminals').astype(np.float32, copy=False)
+        # the behavior policy is trained on the raw actions. The transform is deterministic, so apply it once.
+        dataset['raw_act'] = self.agent.behavior_policy.inverse_transform_action(dataset['act']).numpy()
         replay_size = dataset['obs'].shape[0]
         self.logger.log(f'Dataset size: {replay_size}')
-        self.replay_buffer = PyUniformReplayBuffer.from_data_dict(
-            data=dataset,
-            batch_size=batch_size
-        )
+        self.replay_buffer = TFUniformReplayBuffer(data=dataset, batch_size=batch_size)
 
     def setup_agent(self,
                     num_ensembles,
@@ -654,6 +743,8 @@ class BRACPRunner(TFRunner):
                     entropy_reg,
                     kl_backup,
                     max_ood_grad_norm,
+                    mixed_precision=False,
+                    target_update_interval=1,
                     ):
         obs_dim = self.env.single_observation_space.shape[-1]
         act_dim = self.env.single_action_space.shape[-1]
@@ -668,13 +759,15 @@ class BRACPRunner(TFRunner):
                                 target_entropy=target_entropy, use_gp=use_gp,
                                 reg_type=reg_type, sigma=sigma, n=n, gp_weight=gp_weight,
                                 entropy_reg=entropy_reg, kl_backup=kl_backup, max_ood_grad_norm=max_ood_grad_norm,
-                                gp_type=gp_type)
+                                gp_type=gp_type, mixed_precision=mixed_precision,
+                                target_update_interval=target_update_interval)
         self.agent.set_logger(self.logger)
         self.behavior_filepath = os.path.join(self.logger.output_dir, 'behavior.ckpt')
         self.policy_behavior_filepath = os.path.join(self.logger.output_dir,
                                                      f'policy_behavior_{target_entropy}_{reg_type}.ckpt')
-        self.log_beta_behavior_filepath = os.path.join(self.logger.output_dir,
-                                                       f'policy_behavior_log_beta_{target_entropy}_{reg_type}.ckpt')
+        # the cloned policy and its log_beta are written to and restored from a single checkpoint
+        self.policy_behavior_checkpoint = tf.train.Checkpoint(policy=self.agent.policy_net,
+                                                              log_beta=self.agent.log_beta)
         self.final_filepath = os.path.join(self.logger.output_dir, 'agent_final.ckpt')
 
     def setup_extra(self,
@@ -695,7 +788,7 @@ class BRACPRunner(TFRunner):
         self.std_scale = std_scale
 
     def run_one_step(self, t):
-        self.agent.update(self.replay_buffer)
+        self.agent.update(self.replay_buffer.sample())
 
     def on_epoch_end(self, epoch):
         self.test_agent(agent=self.agent, name='policy', logger=self.logger)
@@ -717,6 +810,30 @@ class BRACPRunner(TFRunner):
         if self.save_freq is not None and (epoch + 1) % self.save_freq == 0:
             self.agent.save_weights(filepath=os.path.join(self.logger.output_dir, f'agent_final_{epoch + 1}.ckpt'))
 
+    @tf.function
+    def compute_dataset_behavior_nll(self, obs_raw_act_dataset):
+        """ Average negative log likelihood of the behavior policy over the dataset, reduced in a single graph """
+
+        def reduce_fn(total, data):
+            obs, raw_act = data
+            loss = self.agent.behavior_policy.test_step(data=((raw_act, obs),))['loss']
+            return total + loss * tf.cast(tf.shape(obs)[0], dtype=tf.float32)
+
+        total = obs_raw_act_dataset.reduce(tf.constant(0., dtype=tf.float32), reduce_fn)
+        return total / tf.cast(len(self.replay_buffer), dtype=tf.float32)
+
+    @tf.function
+    def compute_dataset_pi_pib_distance(self, obs_raw_act_dataset):
+        """ Average distance between pi and pi_b over the dataset, reduced in a single graph """
+
+        def reduce_fn(total, data):
+            obs, _ = data
+            distance = self.agent.compute_pi_pib_distance(obs)[0]
+            return total + tf.cast(tf.reduce_sum(distance), dtype=tf.float32)
+
+        total = obs_raw_act_dataset.reduce(tf.constant(0., dtype=tf.float32), reduce_fn)
+        return total / tf.cast(len(self.replay_buffer), dtype=tf.float32)
+
     def on_train_begin(self):
         self.agent.set_behavior_policy_optimizer(self.pretrain_epochs, self.steps_per_epoch)
         try:
@@ -732,14 +849,12 @@ class BRACPRunner(TFRunner):
             EpochLogger.log('The structure of model is altered. Add --pretrain_behavior flag.', color='red')
             raise
 
-        obs_act_dataset = tf.data.Dataset.from_tensor_slices((self.replay_buffer.get()['obs'],
-                                                              self.replay_buffer.get()['act'])).batch(1000)
+        # the dataset is reduced twice, for the behavior NLL and for the pi/pi_b distance. Cache the batches
+        obs_raw_act_dataset = tf.data.Dataset.from_tensor_slices((self.replay_buffer.get()['obs'],
+                                                                  self.replay_buffer.get()['raw_act']))
+        obs_raw_act_dataset = obs_raw_act_dataset.batch(8192).cache().prefetch(tf.data.AUTOTUNE)
         # evaluate dataset log probability
-        behavior_nll = []
-        for obs, act in obs_act_dataset:
-            raw_act = self.agent.behavior_policy.inverse_transform_action(act)
-            behavior_nll.append(self.agent.behavior_policy.test_on_batch(x=(raw_act, obs))['loss'])
-        behavior_nll = tf.reduce_mean(tf.concat(behavior_nll, axis=0)).numpy()
+        behavior_nll = self.compute_dataset_behavior_nll(obs_raw_act_dataset).numpy()
         self.logger.log(f'Behavior policy data log probability is {-behavior_nll:.4f}')
         # set target_entropy heuristically as -behavior_log_prob - act_dim
         if self.agent.target_entropy is None:
@@ -752,23 +867,18 @@ class BRACPRunner(TFRunner):
         try:
             if self.force_pretrain_cloning:
                 raise tf.errors.NotFoundError(None, None, None)
-            self.agent.policy_net.load_weights(filepath=self.policy_behavior_filepath).assert_consumed()
-            self.agent.log_beta.load_weights(filepath=self.log_beta_behavior_filepath).assert_consumed()
+            self.policy_behavior_checkpoint.read(self.policy_behavior_filepath).assert_consumed()
             self.agent.hard_update_policy_target()
             EpochLogger.log(f'Successfully load initial policy from {self.policy_behavior_filepath}')
         except tf.errors.NotFoundError:
             self.agent.pretrain_cloning(self.pretrain_epochs, self.steps_per_epoch, self.replay_buffer)
-            self.agent.policy_net.save_weights(filepath=self.policy_behavior_filepath)
-            self.agent.log_beta.save_weights(filepath=self.log_beta_behavior_filepath)
+            self.policy_behavior_checkpoint.write(self.policy_behavior_filepath)
         except AssertionError as e:
             print(e)
             EpochLogger.log('The structure of model is altered. Add --pretrain_cloning flag', color='red')
             raise
 
-        distance = []
-        for obs, act in obs_act_dataset:
-            distance.append(self.agent.compute_pi_pib_distance(obs)[0])
-        distance = tf.reduce_mean(tf.concat(distance, axis=0)).numpy()
+        distance = self.compute_dataset_pi_pib_distance(obs_raw_act_dataset).numpy()
 
         self.logger.log(f'The average distance ({self.agent.reg_type}) between pi and pi_b is {distance:.4f}')
         # set max_kl heuristically if it is None.
@@ -820,11 +930,14 @@ class BRACPRunner(TFRunner):
              generalization_threshold=0.1,
              std_scale=4.,
              max_ood_grad_norm=0.01,
+             mixed_precision=False,
+             target_update_interval=1,
              # behavior policy
              num_ensembles=3,
              behavior_mlp_hidden=256,
              behavior_lr=1e-3,
              # others
+             asynchronous_test_env=True,
              reward_scale=True,
              save_freq: int = None,
              tensorboard=False,
@@ -865,9 +978,13 @@ class BRACPRunner(TFRunner):
             kl_backup (bool): whether add the KL loss to the backup value of the target Q network
             generalization_threshold (float): generalization threshold used to compute max_kl when max_kl is None
             std_scale (float): standard deviation scale when computing target_entropy when it is None.
+            mixed_precision (bool): whether to run the policy and Q networks under the mixed_bfloat16 policy
+            target_update_interval (int): number of gradient steps between two target updates. The targets are updated
+                with 1 - (1 - tau) ** target_update_interval to match the per-step polyak average
             num_ensembles (int): number of ensembles to train the behavior policy
             behavior_mlp_hidden (int): MLP hidden size of the behavior policy
             behavior_lr (float): the learning rate of the behavior policy
+            asynchronous_test_env (bool): whether to step the test environments in subprocesses
             reward_scale (bool): whether to use reward scale or not. By default, it will scale to [0, 1]
             save_freq (int or None): the frequency to save the model
             tensorboard (bool): whether to turn on tensorboard logging
@@ -877,7 +994,7 @@ class BRACPRunner(TFRunner):
 
         runner = cls(seed=seed, steps_per_epoch=steps_per_epoch, epochs=epochs,
                      exp_name=None, logger_path=logger_path)
-        runner.setup_env(env_name=env_name, num_parallel_env=num_test_episodes, asynchronous=False,
+        runner.setup_env(env_name=env_name, num_parallel_env=num_test_episodes, asynchronous=asynchronous_test_env,
                          num_test_episodes=None)
         runner.setup_logger(config=config, tensorboard=tensorboard)
         runner.setup_agent(num_ensembles=num_ensembles,
@@ -888,7 +1005,8 @@ class BRACPRunner(TFRunner):
                            target_entropy=target_entropy, use_gp=use_gp,
                            policy_behavior_lr=policy_behavior_lr,
                            reg_type=reg_type, sigma=sigma, n=n, gp_weight=gp_weight, gp_type=gp_type,
-                           entropy_reg=entropy_reg, kl_backup=kl_backup, max_ood_grad_norm=max_ood_grad_norm)
+                           entropy_reg=entropy_reg, kl_backup=kl_backup, max_ood_grad_norm=max_ood_grad_norm,
+                           mixed_precision=mixed_precision, target_update_interval=target_update_interval)
         runner.setup_extra(pretrain_epochs=pretrain_epochs,
                            save_freq=save_freq,
                            max_kl=max_kl,
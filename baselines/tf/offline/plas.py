@@ -61,6 +61,8 @@ class PLASAgent(tf.keras.Model):
         self.tau = tau
         self.gamma = gamma
         self.latent_threshold = latent_threshold
+        # running sum of the pretraining loss, so that it is only fetched once per epoch
+        self.pretrain_loss = tf.Variable(initial_value=0., trainable=False)
 
     def get_action(self, policy_net, obs):
         z = policy_net(obs)
@@ -189,19 +191,22 @@ class PLASAgent(tf.keras.Model):
         pi_final = tf.gather_nd(samples, idx)
         return pi_final
 
+    @tf.function
+    def _pretrain_behavior_policy_step(self, obs, act):
+        raw_act = self.behavior_policy.inverse_transform_action(act)
+        behavior_loss = self.behavior_policy.train_on_batch(x=(raw_act, obs))['loss']
+        self.pretrain_loss.assign_add(behavior_loss)
+
     def pretrain_behavior_policy(self, epochs, steps_per_epoch, replay_buffer):
         EpochLogger.log(f'Training behavior policy')
         t = trange(epochs)
         for epoch in t:
-            loss = []
+            self.pretrain_loss.assign(0.)
             for _ in trange(steps_per_epoch, desc=f'Epoch {epoch + 1}/{epochs}', leave=False):
                 # update q_b, pi_0, pi_b
                 data = replay_buffer.sample()
-                obs = data['obs']
-                raw_act = self.behavior_policy.inverse_transform_action(data['act'])
-                behavior_loss = self.behavior_policy.train_on_batch(x=(raw_act, obs))['loss']
-                loss.append(behavior_loss)
-            loss = tf.reduce_mean(loss).numpy()
+                self._pretrain_behavior_policy_step(data['obs'], data['act'])
+            loss = self.pretrain_loss.numpy() / steps_per_epoch
             t.set_description(desc=f'Loss: {loss:.2f}')
 
 
@@ -231,23 +236,25 @@ class Runner(TFRunner):
                             batch_size,
                             reward_scale=True):
         import d4rl
-        def rescale(x):
-            return (x - np.min(x)) / (np.max(x) - np.min(x))
 
         self.dummy_env = gym.make(self.env_name)
         dataset = d4rl.qlearning_dataset(env=self.dummy_env)
 
         if reward_scale:
             EpochLogger.log('Using reward scale', color='red')
-            self.agent.reward_scale_factor = np.max(dataset['rewards'] - np.min(dataset['rewards']))
+            rewards = dataset['rewards']
+            reward_min = np.min(rewards)
+            self.agent.reward_scale_factor = np.max(rewards) - reward_min
             EpochLogger.log(f'The scale factor is {self.agent.reward_scale_factor:.2f}')
-            dataset['rewards'] = rescale(dataset['rewards'])
+            # rescale to [0, 1] in place
+            np.subtract(rewards, reward_min, out=rewards)
+            np.divide(rewards, self.agent.reward_scale_factor, out=rewards)
         # modify keys
-        dataset['obs'] = dataset.pop('observations').astype(np.float32)
-        dataset['act'] = dataset.pop('actions').astype(np.float32)
-        dataset['obs2'] = dataset.pop('next_observations').astype(np.float32)
-        dataset['rew'] = dataset.pop('rewards').astype(np.float32)
-        dataset['done'] = dataset.pop('terminals').astype(np.float32)
+        dataset['obs'] = dataset.pop('observations').astype(np.float32, copy=False)
+        dataset['act'] = dataset.pop('actions').astype(np.float32, copy=False)
+        dataset['obs2'] = dataset.pop('next_observations').astype(np.float32, copy=False)
+        dataset['rew'] = dataset.pop('rewards').astype(np.float32, copy=False)
+        dataset['done'] = dataset.pop('terminals').astype(np.float32, copy=False)
         replay_size = dataset['obs'].shape[0]
         self.logger.log(f'Dataset size: {replay_size}')
         self.replay_buffer = UniformPyDictReplayBuffer.from_data_dict(
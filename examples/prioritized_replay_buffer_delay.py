@@ -78,6 +78,7 @@ def run_offpolicy(env_name: str,
 
     # setup sampler
     sampler = rl_infra.samplers.BatchSampler(env=env, n_steps=n_steps, gamma=gamma,
+                                             reward_scale=getattr(agent, 'reward_scale', 1.0),
                                              seed=seeder.generate_seed())
 
     # setup tester
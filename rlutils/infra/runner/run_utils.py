@@ -8,6 +8,7 @@ import subprocess
 import sys
 import time
 import zlib
+from concurrent.futures import ThreadPoolExecutor
 from subprocess import CalledProcessError
 from textwrap import dedent
 
@@ -425,7 +426,7 @@ class ExperimentGrid:
         new_variants = [unflatten_var(var) for var in flat_variants]
         return new_variants
 
-    def run(self, thunk, num_cpu=1, data_dir=None, datestamp=False):
+    def run(self, thunk, num_cpu=1, data_dir=None, datestamp=False, num_parallel=1):
         """
         Run each variant in the grid with function 'thunk'.
 
@@ -439,6 +440,11 @@ class ExperimentGrid:
         Maintenance note: the args for ExperimentGrid.run should track closely
         to the args for call_experiment. However, ``seed`` is omitted because
         we presume the user may add it as a parameter in the grid.
+
+        ``num_parallel`` is the number of variants that run at the same time.
+        Each variant already runs in its own subprocess, so they are launched
+        from a thread pool that only waits on them. The outputs of concurrent
+        variants are interleaved.
         """
 
         # Print info about self.
@@ -475,7 +481,7 @@ class ExperimentGrid:
                 time.sleep(wait / steps)
 
         # Run the variants.
-        for var in variants:
+        def run_variant(var):
             exp_name = self.variant_name(var)
 
             # Figure out what the thunk is.
@@ -492,6 +498,15 @@ class ExperimentGrid:
             call_experiment(exp_name, thunk_, num_cpu=num_cpu,
                             data_dir=data_dir, datestamp=datestamp, **var)
 
+        if num_parallel > 1:
+            with ThreadPoolExecutor(max_workers=num_parallel) as executor:
+                futures = [executor.submit(run_variant, var) for var in variants]
+                for future in futures:
+                    future.result()  # re-raise the failure of any variant
+        else:
+            for var in variants:
+                run_variant(var)
+
 
 def test_eg():
     eg = ExperimentGrid()
@@ -6,10 +6,12 @@ from .base import Sampler
 
 
 class BatchSampler(Sampler):
-    def __init__(self, n_steps, gamma, **kwargs):
+    def __init__(self, n_steps, gamma, reward_scale=1.0, **kwargs):
         super(BatchSampler, self).__init__(**kwargs)
         self.n_steps = n_steps
         self.gamma = gamma
+        # rewards are scaled once at insertion instead of on every sampled batch. EpRet is logged unscaled.
+        self.reward_scale = reward_scale
         self.gamma_vector = gamma ** np.arange(self.n_steps)
         self.gamma_vector = np.expand_dims(self.gamma_vector, axis=0)  # (1, n_steps)
         self.oa_queue = collections.deque(maxlen=n_steps)
@@ -31,13 +33,19 @@ class BatchSampler(Sampler):
         self.logger.log_tabular('TotalEnvInteracts', self._global_env_step)
 
     def sample(self, num_steps, collect_fn, replay_buffer):
+        # loop invariant attributes are bound to locals once per call instead of looked up on every env step
+        env = self.env
+        oa_queue, rew_queue = self.oa_queue, self.rew_queue
+        n_steps, gamma_vector, reward_scale = self.n_steps, self.gamma_vector, self.reward_scale
+        n_step_gamma = self.gamma ** self.n_steps
+        ep_ret, ep_len = self.ep_ret, self.ep_len
         for _ in range(num_steps):
             a = collect_fn(self.o)
             assert not np.any(np.isnan(a)), f'NAN action: {a}'
             # Step the env
-            o2, r, terminate, truncate, infos = self.env.step(a)
-            self.ep_ret += r
-            self.ep_len += 1
+            o2, r, terminate, truncate, infos = env.step(a)
+            ep_ret += r
+            ep_len += 1
 
             d = np.logical_or(terminate, truncate)
 
@@ -51,24 +59,24 @@ class BatchSampler(Sampler):
             else:
                 next_obs = o2
 
-            self.oa_queue.append((self.o, a))
-            self.rew_queue.append(r)
+            oa_queue.append((self.o, a))
+            rew_queue.append(r)
 
-            valid = self.ep_len >= self.n_steps
+            valid = ep_len >= n_steps
 
             if np.any(valid):
-                last_o, last_a = self.oa_queue.popleft()
-                last_r = np.sum(np.stack(self.rew_queue, axis=-1) * self.gamma_vector, axis=-1)  # (num_envs,)
-                self.rew_queue.popleft()
+                last_o, last_a = oa_queue.popleft()
+                last_r = np.sum(np.stack(rew_queue, axis=-1) * gamma_vector, axis=-1)  # (num_envs,)
+                rew_queue.popleft()
 
                 # Store experience to replay buffer
                 replay_buffer.add(dict(
                     obs=last_o[valid],
                     act=last_a[valid],
-                    rew=last_r[valid],
+                    rew=last_r[valid] * reward_scale,
                     next_obs=next_obs[valid],
                     done=true_d[valid],
-                    gamma=np.ones_like(true_d[valid]).astype(np.float32) * (self.gamma ** self.n_steps)
+                    gamma=np.ones_like(true_d[valid]).astype(np.float32) * n_step_gamma
                 ))
 
             # Super critical, easy to overlook step: make sure to update
@@ -78,8 +86,8 @@ class BatchSampler(Sampler):
             # End of trajectory handling
             if np.any(d):
                 if self.logger is not None:
-                    self.logger.store(EpRet=self.ep_ret[d], EpLen=self.ep_len[d])
-                self.ep_ret[d] = 0
-                self.ep_len[d] = 0
+                    self.logger.store(EpRet=ep_ret[d], EpLen=ep_len[d])
+                ep_ret[d] = 0
+                ep_len[d] = 0
 
-            self._global_env_step += self.env.num_envs
+            self._global_env_step += env.num_envs
@@ -89,7 +89,7 @@ class BatchFrameStackSampler(BatchSampler):
                 replay_buffer.add(dict(
                     obs=valid_o,
                     act=last_a[valid],
-                    rew=last_r[valid],
+                    rew=last_r[valid] * self.reward_scale,
                     next_obs=valid_next_o,
                     done=true_d[valid],
                     gamma=np.ones_like(true_d[valid]).astype(np.float32) * (self.gamma ** self.n_steps)
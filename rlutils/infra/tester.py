@@ -57,36 +57,38 @@ class Tester(LogUser):
         start = time.time()
         already_timeout = False
 
+        num_envs = self.test_env.num_envs
         for _ in range(num_iterations):
             o, _ = self.test_env.reset(seed=self.seed)  # keep evaluating the same random obs
-            d = np.zeros(shape=self.test_env.num_envs, dtype=np.bool_)
-            ep_ret = np.zeros(shape=self.test_env.num_envs, dtype=np.float64)
-            ep_len = np.zeros(shape=self.test_env.num_envs, dtype=np.int64)
+            d = np.zeros(shape=num_envs, dtype=np.bool_)
+            ep_ret = np.zeros(shape=num_envs, dtype=np.float64)
+            ep_len = np.zeros(shape=num_envs, dtype=np.int64)
+            num_done = 0
             steps = 0
             batch_action = None
-            while not np.all(d):
-                a = get_action(o[np.logical_not(d)])  # only inference on valid observations
+            while num_done < num_envs:
+                alive = np.logical_not(d)
+                # a single batched inference per step. Finished envs are masked out once any episode ends
+                a = get_action(o) if num_done == 0 else get_action(o[alive])
+                assert isinstance(a, np.ndarray), f'Action a must be np.ndarray. Got {type(a)}'
 
                 # init batch action
                 if batch_action is None:
                     batch_action = np.zeros_like(a)
 
-                batch_action[np.logical_not(d)] = a
-                assert isinstance(a, np.ndarray), f'Action a must be np.ndarray. Got {type(a)}'
+                batch_action[alive] = a
                 o, r, terminate, truncate, _ = self.test_env.step(batch_action)
 
+                ep_ret += r * alive
+                ep_len += alive
                 # done happens either it is truely terminated or is truncated due to time limits
-                d_ = np.logical_or(terminate, truncate)
-
-                ep_ret = r * (1 - d) + ep_ret
-                ep_len = np.ones(shape=self.test_env.num_envs, dtype=np.int64) * (1 - d) + ep_len
-                prev_d = d.copy()
-                d = np.logical_or(d, d_)
+                np.logical_or(d, terminate, out=d)
+                np.logical_or(d, truncate, out=d)
 
-                if t is not None:
-                    newly_finished = np.sum(d) - np.sum(prev_d)
-                    if newly_finished > 0:
-                        t.update(newly_finished)
+                prev_num_done = num_done
+                num_done = np.count_nonzero(d)
+                if t is not None and num_done > prev_num_done:
+                    t.update(num_done - prev_num_done)
                 steps += 1
                 if max_episode_length is not None and steps >= max_episode_length:
                     break
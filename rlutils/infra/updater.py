@@ -2,6 +2,8 @@
 An updater updates the agent from the replay buffer. It also maintains statistics of the update.
 """
 
+import queue
+import threading
 from abc import ABC, abstractmethod
 
 
@@ -23,16 +25,72 @@ class OnPolicyUpdater(PolicyUpdater):
 
 
 class OffPolicyUpdater(PolicyUpdater):
-    def __init__(self, agent, replay_buffer, update_per_step, update_every, update_after, batch_size):
+    def __init__(self, agent, replay_buffer, update_per_step, update_every, update_after, batch_size, prefetch=0):
+        """
+        Args:
+            prefetch: number of minibatches sampled ahead by a background thread, so that sampling overlaps with
+                train_on_batch. The prefetched minibatches don't contain the transitions added after they are
+                sampled, and which transitions they contain depends on the thread timing, so seeded runs are not
+                reproducible. 0 samples in the main thread. Call close to stop the thread.
+        """
         super(OffPolicyUpdater, self).__init__(agent=agent, replay_buffer=replay_buffer)
         self.update_per_step = update_per_step
         self.update_every = update_every
         self.update_after = update_after
         self.batch_size = batch_size
+        self.prefetch = prefetch
+        self.prefetch_queue = None
+        self.prefetch_thread = None
+        self.stop_event = threading.Event()
+
+    def prefetch_batches(self):
+        while not self.stop_event.is_set():
+            try:
+                item = self.replay_buffer.sample(self.batch_size)
+            except Exception as e:
+                # hand the exception to the consumer instead of leaving it blocked on an empty queue
+                item = e
+            while not self.stop_event.is_set():
+                try:
+                    self.prefetch_queue.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            if isinstance(item, Exception):
+                return
+
+    def get_batches(self, num_updates):
+        if self.prefetch > 0:
+            if self.prefetch_thread is None:
+                # start after update_after, when the replay buffer is not empty
+                self.prefetch_queue = queue.Queue(maxsize=self.prefetch)
+                self.prefetch_thread = threading.Thread(target=self.prefetch_batches, daemon=True)
+                self.prefetch_thread.start()
+            for _ in range(num_updates):
+                item = self.prefetch_queue.get()
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        elif hasattr(self.replay_buffer, 'sample_many'):
+            batches = self.replay_buffer.sample_many(num_updates, self.batch_size)
+            for i in range(num_updates):
+                yield {key: item[i] for key, item in batches.items()}
+        else:
+            for _ in range(num_updates):
+                yield self.replay_buffer.sample(self.batch_size)
+
+    def close(self):
+        """ Stop the prefetch thread """
+        if self.prefetch_thread is not None:
+            self.stop_event.set()
+            self.prefetch_thread.join()
+            self.prefetch_thread = None
+            self.prefetch_queue = None
+            self.stop_event.clear()
 
     def update(self, global_step):
         if global_step > self.update_after:
             if global_step % self.update_every == 0:
-                for _ in range(int(self.update_per_step * self.update_every)):
-                    batch = self.replay_buffer.sample(self.batch_size)
+                num_updates = int(self.update_per_step * self.update_every)
+                for batch in self.get_batches(num_updates):
                     info = self.agent.train_on_batch(data=batch)
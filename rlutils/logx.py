@@ -340,7 +340,7 @@ class EpochLogger(Logger):
             elif isinstance(v, torch.Tensor):
                 v = torch.flatten(v.detach())  # if v is on GPU, keeps it there and only transfer back after concat
             elif isinstance(v, np.ndarray):
-                pass
+                v = np.reshape(v, -1)  # 0-d arrays can't be concatenated
             else:
                 raise ValueError(f'Unknown dtype {type(v)}')
             # assert isinstance(v, np.ndarray), "The data must be a numpy array or raw data type. Got {}".format(type(v))
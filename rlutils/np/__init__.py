@@ -1,3 +1,3 @@
 from .functional import gather_dict_key, flatten_dict, shuffle_dict_data, inverse_softplus, flatten_leading_dims, \
-    clip_arctanh, discount_cumsum
+    clip_arctanh, discount_cumsum, stack_array_likes
 from . import schedulers
\ No newline at end of file
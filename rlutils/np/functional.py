@@ -1,8 +1,8 @@
 from typing import Dict, List
 
 import numpy as np
-import scipy.signal
 import sklearn
+from numba import njit
 
 EPS = 1e-6
 
@@ -50,6 +50,20 @@ def inverse_softplus(x, beta=1.):
         return x
 
 
+def stack_array_likes(items: List):
+    """ Stack a list of array-like objects of the same shape (e.g., LazyFrames) into a preallocated array.
+    np.array(items) converts each item into a temporary array before copying it into the output.
+    """
+    if len(items) == 0:
+        return np.array(items)
+    first = np.asarray(items[0])
+    output = np.empty(shape=(len(items),) + first.shape, dtype=first.dtype)
+    output[0] = first
+    for i in range(1, len(items)):
+        output[i] = items[i]
+    return output
+
+
 def flatten_leading_dims(array, n_dims):
     """ Flatten the leading n dims of a numpy array """
     if n_dims <= 1:
@@ -75,4 +89,23 @@ def discount_cumsum(x, discount):
          x1 + discount * x2,
          x2]
     """
-    return scipy.signal.lfilter([1], [1, float(-discount)], x[::-1], axis=0)[::-1]
+    x = np.asarray(x)
+    if not np.issubdtype(x.dtype, np.floating):
+        x = x.astype(np.float64)
+    # flatten the trailing dimensions so that the reverse scan runs on a contiguous 2D array
+    flat_x = np.ascontiguousarray(x.reshape(x.shape[0], int(np.prod(x.shape[1:]))))
+    return _discount_cumsum(flat_x, float(discount)).reshape(x.shape)
+
+
+@njit(cache=True)
+def _discount_cumsum(x: np.ndarray, discount: float) -> np.ndarray:
+    """Numba version of the reverse scan out[i] = x[i] + discount * out[i + 1] along axis 0."""
+    out = np.empty_like(x)
+    n = x.shape[0]
+    if n == 0:
+        return out
+    out[n - 1] = x[n - 1]
+    for i in range(n - 2, -1, -1):
+        for j in range(x.shape[1]):
+            out[i, j] = x[i, j] + discount * out[i + 1, j]
+    return out
@@ -1,4 +1,4 @@
-from typing import Iterable
+from typing import Iterable, List
 
 import torch
 import torch.nn as nn
@@ -26,16 +26,27 @@ def model_averaging(global_model: nn.Module, local_models: Iterable[nn.Module]):
         target_param.data.copy_(param.to(target_param.data.device))
 
 
-def soft_update(target: nn.Module, source: nn.Module, tau):
+def soft_update_params(target_params: List[torch.Tensor], source_params: List[torch.Tensor], tau):
+    """
+    Polyak averaging with multi-tensor kernels instead of one kernel per parameter.
+    """
     with torch.no_grad():
-        for target_param, param in zip(target.parameters(), source.parameters()):
-            target_param.data.copy_(target_param.data * (1.0 - tau) + param.data.to(target_param.data.device) * tau)
+        source_params = [param.to(target_param.device) for target_param, param in zip(target_params, source_params)]
+        torch._foreach_mul_(target_params, 1.0 - tau)
+        torch._foreach_add_(target_params, source_params, alpha=tau)
 
 
-def hard_update(target: nn.Module, source: nn.Module):
+def hard_update_params(target_params: List[torch.Tensor], source_params: List[torch.Tensor]):
     with torch.no_grad():
-        for target_param, param in zip(target.parameters(), source.parameters()):
-            target_param.data.copy_(param.data.to(target_param.data.device))
+        torch._foreach_copy_(target_params, source_params)
+
+
+def soft_update(target: nn.Module, source: nn.Module, tau):
+    soft_update_params(list(target.parameters()), list(source.parameters()), tau)
+
+
+def hard_update(target: nn.Module, source: nn.Module):
+    hard_update_params(list(target.parameters()), list(source.parameters()))
 
 
 def compute_target_value(reward, gamma, done, next_q):
@@ -43,6 +54,16 @@ def compute_target_value(reward, gamma, done, next_q):
     return q_target
 
 
+@torch.jit.script
+def add_clipped_noise(a: torch.Tensor, noise_std: float, noise_clip: float, act_lim: float):
+    """
+    Add clipped gaussian noise to the actions and clip the result to the action bound. Scripted so that the
+    elementwise ops are fused.
+    """
+    epsilon = torch.randn_like(a).mul_(noise_std).clamp_(-noise_clip, noise_clip)
+    return (a + epsilon).clamp_(-act_lim, act_lim)
+
+
 def clip_by_value_preserve_gradient(t, clip_value_min=None, clip_value_max=None):
     clip_t = torch.clip(t, min=clip_value_min, max=clip_value_max)
     return t + (clip_t - t).detach()
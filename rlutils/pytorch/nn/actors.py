@@ -1,29 +1,110 @@
+import math
+from typing import Tuple
+
 import torch
 import torch.nn as nn
-from rlutils.pytorch.distributions import make_independent_normal_from_params, apply_squash_log_prob
+from rlutils.pytorch.distributions import make_independent_normal_from_params
 
 from .functional import build_mlp
 
 
+@torch.jit.script
+def _select_squashed_action(params: torch.Tensor, deterministic: bool, min_log_scale: float, max_log_scale: float):
+    """
+    Sample (or take the mean of) the tanh squashed gaussian parameterized by params without building the
+    distribution object. The scale follows make_independent_normal_from_params.
+    """
+    loc, scale = torch.chunk(params, 2, dim=-1)
+    if deterministic:
+        pi_action = loc
+    else:
+        scale = torch.nn.functional.softplus(scale.clamp(min_log_scale, max_log_scale))
+        pi_action = loc + torch.randn_like(loc) * scale
+    return torch.tanh(pi_action)
+
+
+@torch.jit.script
+def _squashed_normal_log_prob(loc: torch.Tensor, scale: torch.Tensor, raw_action: torch.Tensor):
+    """
+    Log probability of tanh(raw_action) under the tanh squashed independent normal. Same math as
+    Independent(Normal(loc, scale), 1).log_prob followed by apply_squash_log_prob, in a single scripted function.
+    """
+    log_prob = -((raw_action - loc) ** 2) / (2. * scale ** 2) - torch.log(scale) - math.log(math.sqrt(2. * math.pi))
+    log_det_jacobian = 2. * (math.log(2.) - raw_action - torch.nn.functional.softplus(-2. * raw_action))
+    return torch.sum(log_prob, dim=-1) - torch.sum(log_det_jacobian, dim=-1)
+
+
+@torch.jit.script
+def _clip_atanh(actions: torch.Tensor, eps: float):
+    """ Inverse of tanh on actions clipped into (-1, 1). Scripted so that the clip and atanh are fused """
+    return torch.atanh(actions.clamp(-1. + eps, 1. - eps))
+
+
+@torch.jit.script
+def _loc_scale_from_params(params: torch.Tensor, min_log_scale: float,
+                           max_log_scale: float) -> Tuple[torch.Tensor, torch.Tensor]:
+    loc, scale = torch.chunk(params, 2, dim=-1)
+    scale = torch.nn.functional.softplus(scale.clamp(min_log_scale, max_log_scale))
+    return loc, scale
+
+
+@torch.jit.script
+def _sample_squashed_action_log_prob(params: torch.Tensor, deterministic: bool, min_log_scale: float,
+                                     max_log_scale: float) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    """ Returns the squashed action, its log probability and the raw action """
+    loc, scale = _loc_scale_from_params(params, min_log_scale, max_log_scale)
+    if deterministic:
+        pi_action = loc
+    else:
+        pi_action = loc + torch.randn_like(loc) * scale
+    logp_pi = _squashed_normal_log_prob(loc, scale, pi_action)
+    return torch.tanh(pi_action), logp_pi, pi_action
+
+
+def _select_deterministic(net: nn.Module, obs):
+    loc, _ = torch.chunk(net(obs), 2, dim=-1)
+    return torch.tanh(loc)
+
+
+def _select_stochastic(net: nn.Module, obs, min_log_scale: float, max_log_scale: float):
+    return _select_squashed_action(net(obs), False, min_log_scale, max_log_scale)
+
+
 class SquashedGaussianMLPActor(nn.Module):
-    def __init__(self, ob_dim, ac_dim, mlp_hidden, num_layers=3):
+    def __init__(self, ob_dim, ac_dim, mlp_hidden, num_layers=3, compile_model=False):
+        """
+        Args:
+            compile_model: run select_action through torch.compile(mode='reduce-overhead'). On CUDA the compiled
+                call replays a CUDA graph: each new batch size is captured once and the returned actions are
+                overwritten by the next call, so consume them (e.g., .cpu()) before acting again.
+        """
         super(SquashedGaussianMLPActor, self).__init__()
         self.net = build_mlp(ob_dim, ac_dim * 2, mlp_hidden, num_layers=num_layers)
         self.ac_dim = ac_dim
-        self.pi_dist_layer = lambda param: make_independent_normal_from_params(param,
-                                                                               min_log_scale=-10.,
-                                                                               max_log_scale=5.)
+        self.compile_model = compile_model
+        self.min_log_scale = -10.
+        self.max_log_scale = 5.
+        if self.compile_model:
+            # the deterministic and the stochastic branch are compiled separately so that there is no python branch
+            # inside the compiled region. Compilation happens lazily on the first call of each branch, which is slow.
+            self.compiled_select_deterministic = torch.compile(_select_deterministic, mode='reduce-overhead',
+                                                               fullgraph=True)
+            self.compiled_select_stochastic = torch.compile(_select_stochastic, mode='reduce-overhead',
+                                                            fullgraph=True)
 
     def select_action(self, inputs):
         inputs, deterministic = inputs
+        if self.compile_model:
+            if deterministic:
+                return self.compiled_select_deterministic(self.net, inputs)
+            else:
+                return self.compiled_select_stochastic(self.net, inputs, self.min_log_scale, self.max_log_scale)
         params = self.net(inputs)
-        pi_distribution = self.pi_dist_layer(params)
-        if deterministic:
-            pi_action = pi_distribution.mean
-        else:
-            pi_action = pi_distribution.rsample()
-        pi_action_final = torch.tanh(pi_action)
-        return pi_action_final
+        return _select_squashed_action(params, deterministic, self.min_log_scale, self.max_log_scale)
+
+    def pi_dist_layer(self, param):
+        return make_independent_normal_from_params(param, min_log_scale=self.min_log_scale,
+                                                   max_log_scale=self.max_log_scale)
 
     def compute_pi_distribution(self, inputs):
         return self.pi_dist_layer(self.net(inputs))
@@ -32,33 +113,22 @@ class SquashedGaussianMLPActor(nn.Module):
         return torch.tanh(raw_actions)
 
     def compute_raw_actions(self, actions):
-        EPS = 1e-6
-        actions = torch.clip(actions, min=-1. + EPS, max=1. - EPS)
-        return torch.atanh(actions)
+        return _clip_atanh(actions, 1e-6)
 
     def compute_log_prob(self, inputs):
         obs, act = inputs
         params = self.net(obs)
-        pi_distribution = self.pi_dist_layer(params)
+        loc, scale = _loc_scale_from_params(params, self.min_log_scale, self.max_log_scale)
         # compute actions
-        pi_action = pi_distribution.rsample()
+        pi_action = loc + torch.randn_like(loc) * scale
         raw_act = self.compute_raw_actions(act)
         # compute log probability
-        log_prob = pi_distribution.log_prob(raw_act)
-        log_prob = apply_squash_log_prob(log_prob, raw_act)
-        log_prob_pi = pi_distribution.log_prob(pi_action)
-        log_prob_pi = apply_squash_log_prob(log_prob_pi, pi_action)
+        log_prob = _squashed_normal_log_prob(loc, scale, raw_act)
+        log_prob_pi = _squashed_normal_log_prob(loc, scale, pi_action)
         return log_prob, log_prob_pi
 
     def forward(self, inputs):
+        """ Returns the squashed action, its log probability and the raw action """
         inputs, deterministic = inputs
         params = self.net(inputs)
-        pi_distribution = self.pi_dist_layer(params)
-        if deterministic:
-            pi_action = pi_distribution.mean
-        else:
-            pi_action = pi_distribution.rsample()
-        logp_pi = pi_distribution.log_prob(pi_action)
-        logp_pi = apply_squash_log_prob(logp_pi, pi_action)
-        pi_action_final = torch.tanh(pi_action)
-        return pi_action_final, logp_pi, pi_action, pi_distribution
+        return _sample_squashed_action_log_prob(params, deterministic, self.min_log_scale, self.max_log_scale)
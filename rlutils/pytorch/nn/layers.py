@@ -65,7 +65,24 @@ class EnsembleDense(nn.Module):
             nn.init.uniform_(self.bias, -bound, bound)
 
     def forward(self, input: torch.Tensor) -> torch.Tensor:
-        return torch.bmm(input, self.weight) + self.bias
+        """
+
+        Args:
+            input: shape (num_ensembles, None, in_features) or (None, in_features) if the input is shared
+                across all the ensembles.
+
+        Returns: shape (num_ensembles, None, out_features)
+
+        """
+        if input.dim() == 2:
+            # broadcast the shared input instead of materializing num_ensembles copies
+            output = torch.matmul(input, self.weight)
+            if self.bias is not None:
+                output = output + self.bias
+            return output
+        if self.bias is not None:
+            return torch.baddbmm(self.bias, input, self.weight)
+        return torch.bmm(input, self.weight)
 
     def extra_repr(self) -> str:
         return 'num_ensembles={}, in_features={}, out_features={}, bias={}'.format(
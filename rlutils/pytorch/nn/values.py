@@ -25,14 +25,12 @@ class EnsembleMinQNet(nn.Module):
     def forward(self, inputs, training=None):
         assert training is not None
         obs, act = inputs
-        inputs = torch.cat((obs, act), dim=-1)
-        inputs = torch.unsqueeze(inputs, dim=0)  # (1, None, obs_dim + act_dim)
-        inputs = inputs.repeat(self.num_ensembles, 1, 1)
+        inputs = torch.cat((obs, act), dim=-1)  # (None, obs_dim + act_dim), shared by all the ensembles
         q = self.q_net(inputs)  # (num_ensembles, None)
         if training:
             return q
         else:
-            return torch.min(q, dim=0)[0]
+            return torch.amin(q, dim=0)
 
 
 def build_atari_q(frame_stack, action_dim, output_fn=None):
@@ -2,6 +2,8 @@
 Handle global pytorch device and data types
 """
 
+import functools
+
 import numpy as np
 import torch
 
@@ -30,10 +32,16 @@ def get_cuda_device(id=None):
             if id < 0 or id >= torch.cuda.device_count():
                 raise ValueError(f'id {id} exceeds total device count {total_device_count}')
             else:
-                cuda_device = f'cuda:{cuda}'
+                cuda_device = f'cuda:{id}'
     return cuda_device
 
 
+@functools.lru_cache(maxsize=None)
+def is_cuda_device(d):
+    # called on every env step by the agents' act paths. The result is cached per device (str or torch.device)
+    return d is not None and torch.device(d).type == 'cuda'
+
+
 def to_numpy(tensor):
     if isinstance(tensor, torch.Tensor):
         return tensor.detach().cpu().numpy()
@@ -50,10 +58,82 @@ def convert_dict_to_tensor(data, device=None):
     return tensor_data
 
 
+class PinnedDictConverter(object):
+    """
+    Convert a dict of numpy arrays to device tensors. Arrays of the same dtype are packed into one reusable
+    pinned buffer, so that each dtype takes a single H2D copy on a dedicated stream. The returned tensors are
+    views into the device buffer. The current stream waits for the copy before the tensors are returned.
+    Falls back to convert_dict_to_tensor if the device is not cuda. float16 arrays (e.g., sampled from a replay
+    buffer created with store_dtype=np.float16 and cast_on_read=False) are copied as is and cast to upcast_dtype
+    on the device.
+    """
+
+    def __init__(self, device, upcast_dtype=torch.float32):
+        self.device = device
+        self.upcast_dtype = upcast_dtype
+        self.cuda = is_cuda_device(device)
+        self.stream = torch.cuda.Stream(device=device) if self.cuda else None
+        self.pinned = {}
+        self.copy_done = None
+
+    def get_pinned_buffer(self, dtype, numel):
+        buf = self.pinned.get(dtype)
+        if buf is None or buf.numel() < numel:
+            buf = torch.empty(size=(numel,), dtype=dtype, pin_memory=True)
+            self.pinned[dtype] = buf
+        return buf[:numel]
+
+    def upcast(self, tensor_data):
+        for key, d in tensor_data.items():
+            if d.dtype == torch.float16:
+                tensor_data[key] = d.to(self.upcast_dtype)
+        return tensor_data
+
+    def __call__(self, data):
+        if not self.cuda:
+            return self.upcast(convert_dict_to_tensor(data, device=self.device))
+        if self.copy_done is not None:
+            # the pinned buffers can't be overwritten before the previous copy finishes
+            self.copy_done.synchronize()
+
+        groups = {}
+        for key, d in data.items():
+            d = torch.from_numpy(np.ascontiguousarray(d))
+            groups.setdefault(d.dtype, []).append((key, d))
+
+        current_stream = torch.cuda.current_stream(self.device)
+        self.stream.wait_stream(current_stream)
+        tensor_data = {}
+        for dtype, tensors in groups.items():
+            numel = sum(d.numel() for _, d in tensors)
+            buf = self.get_pinned_buffer(dtype, numel)
+            offset = 0
+            for _, d in tensors:
+                buf[offset:offset + d.numel()].copy_(d.reshape(-1))
+                offset += d.numel()
+            # allocated on the current stream, which waits for the copy stream below
+            device_buf = torch.empty(size=(numel,), dtype=dtype, device=self.device)
+            with torch.cuda.stream(self.stream):
+                device_buf.copy_(buf, non_blocking=True)
+            offset = 0
+            for key, d in tensors:
+                tensor_data[key] = device_buf.narrow(0, offset, d.numel()).view(d.shape)
+                offset += d.numel()
+        self.copy_done = self.stream.record_event()
+        current_stream.wait_stream(self.stream)
+        return self.upcast(tensor_data)
+
+
 cpu = torch.device('cpu')
-cuda = []
-for i in range(torch.cuda.device_count()):
-    cuda.append(torch.device(f'cuda:{i}'))
+
+
+def __getattr__(name):
+    # the list of cuda devices is built on first access instead of probing the driver at import time
+    if name == 'cuda':
+        global cuda
+        cuda = [torch.device(f'cuda:{i}') for i in range(torch.cuda.device_count())]
+        return cuda
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 def print_version():
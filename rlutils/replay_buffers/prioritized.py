@@ -17,11 +17,13 @@ EPS = np.finfo(np.float32).eps.item()
 from gym.utils import seeding
 import threading
 
+from rlutils.np.functional import stack_array_likes
 from . import utils, storage
 
 
 class PrioritizedReplayBuffer(object):
-    def __init__(self, data_spec, capacity, alpha=0.6, beta=0.4, eviction=None, seed=None):
+    def __init__(self, data_spec, capacity, alpha=0.6, beta=0.4, eviction=None, seed=None, store_dtype=None,
+                 cast_on_read=True):
         self.eviction = eviction
         if eviction is None:
             print('Using FIFO eviction policy')
@@ -31,7 +33,8 @@ class PrioritizedReplayBuffer(object):
             print(f'Using prioritized eviction policy with alpha_evict={eviction}')
             self.eviction_tree = utils.segtree.SumTree(size=capacity)
 
-        self.storage = storage.PyDictStorage(data_spec=data_spec, capacity=capacity)
+        self.storage = storage.PyDictStorage(data_spec=data_spec, capacity=capacity, store_dtype=store_dtype,
+                                             cast_on_read=cast_on_read)
         self.storage.reset()
         self.alpha = alpha
         self.beta = beta
@@ -127,9 +130,8 @@ class PrioritizedReplayBuffer(object):
             transaction_id = self.get_available_transaction_id()
             self.sampled_idx_mask[transaction_id] = (idx, np.ones(shape=(batch_size,), dtype=np.bool))
 
-        for key, item in data.items():
-            if not isinstance(item, np.ndarray):
-                data[key] = np.array(item)
+        for key in self.storage.obj_key:
+            data[key] = stack_array_likes(data[key])
         return transaction_id, data
 
     def update_priorities(self, transaction_id, priorities, min_priority=None, max_priority=None):
@@ -8,9 +8,23 @@ from .base import Storage
 
 
 class PyDictStorage(Storage):
-    def __init__(self, data_spec: Dict[str, Union[gym.spaces.Space, None]], capacity):
+    def __init__(self, data_spec: Dict[str, Union[gym.spaces.Space, None]], capacity, store_dtype=None,
+                 cast_on_read=True):
+        """
+        Args:
+            data_spec: the space of each key. None means the key is stored as an object
+            capacity: the maximum number of transitions
+            store_dtype: if not None, vector-valued float32 keys (e.g., obs, act) are stored in this dtype
+                (e.g., np.float16) to halve the memory traffic of sampling, and cast back to float32 when read.
+                Scalar keys (e.g., rew, done) are stored in full precision.
+            cast_on_read: if False, the keys stored in store_dtype are returned as stored, so that the
+                host-to-device copy also moves the narrow dtype. The consumer is responsible for the upcast
+                (e.g., rlutils.pytorch.utils.PinnedDictConverter casts them to float32 on the device).
+        """
         self.data_spec = data_spec
         self.max_size = capacity
+        self.store_dtype = None if store_dtype is None else np.dtype(store_dtype)
+        self.cast_on_read = cast_on_read
         self.storage = self._create_storage()
         self.reset()
 
@@ -18,9 +32,14 @@ class PyDictStorage(Storage):
         storage = {}
         self.np_key = []
         self.obj_key = []
+        self.cast_key = {}  # map from the keys stored in store_dtype to their original dtype
         for key, item in self.data_spec.items():
             if isinstance(item, gym.spaces.Space):
-                storage[key] = np.zeros(combined_shape(self.capacity, item.shape), dtype=item.dtype)
+                dtype = item.dtype
+                if self.store_dtype is not None and dtype == np.float32 and item.shape:
+                    self.cast_key[key] = dtype
+                    dtype = self.store_dtype
+                storage[key] = np.zeros(combined_shape(self.capacity, item.shape), dtype=dtype)
                 self.np_key.append(key)
             elif item is None:
                 print(f"Store key {key} as an object")
@@ -28,6 +47,8 @@ class PyDictStorage(Storage):
                 self.obj_key.append(key)
             else:
                 raise ValueError(f'Unknonw type item {type(item)}')
+        # the arrays are never reallocated. Bind them once for __getitem__
+        self._np_items = tuple((key, storage[key], storage[key].ndim > 1) for key in self.np_key)
         return storage
 
     def reset(self):
@@ -38,12 +59,19 @@ class PyDictStorage(Storage):
         return self.size
 
     def __getitem__(self, item):
-        data = {key: self.storage[key][item] for key in self.np_key}
+        # np.take copies whole rows and is about 2x faster than fancy indexing on multi-dimensional fields.
+        # Fancy indexing is faster for 1-D fields.
+        if isinstance(item, np.ndarray):
+            data = {key: np.take(array, item, axis=0) if multi_dim else array[item]
+                    for key, array, multi_dim in self._np_items}
+        else:
+            data = {key: array[item] for key, array, _ in self._np_items}
+        if self.cast_on_read:
+            for key, dtype in self.cast_key.items():
+                data[key] = data[key].astype(dtype)
         for key in self.obj_key:
-            output = []
-            for idx in item:
-                output.append(self.storage[key][idx])
-            data[key] = output
+            # object arrays support fancy indexing. The result is an object array of the stored items
+            data[key] = self.storage[key][item]
         return data
 
     @property
@@ -51,26 +79,41 @@ class PyDictStorage(Storage):
         return self.max_size
 
     def get_available_indexes(self, batch_size):
+        index = np.arange(self.ptr, self.ptr + batch_size)
         if self.ptr + batch_size > self.max_size:
-            index = np.concatenate((np.arange(self.ptr, self.capacity),
-                                    np.arange(batch_size - (self.capacity - self.ptr))), axis=0)
-            # print('Reaches the end of the replay buffer')
-        else:
-            index = np.arange(self.ptr, self.ptr + batch_size)
+            # wrap around in place instead of concatenating two ranges
+            np.remainder(index, self.capacity, out=index)
         return index
 
+    def _available_slices(self, batch_size):
+        """ The contiguous ranges written by the next add. Two slices if the write wraps around the end. """
+        if self.ptr + batch_size > self.max_size:
+            return slice(self.ptr, self.capacity), slice(0, batch_size - (self.capacity - self.ptr))
+        else:
+            return slice(self.ptr, self.ptr + batch_size),
+
     def add(self, data: Dict[str, np.ndarray], index=None):
         batch_size = len(data[self.np_key[0]])
         if index is None:
+            # slice assignment copies contiguous memory instead of going through the fancy indexing loop
+            slices = self._available_slices(batch_size)
             index = self.get_available_indexes(batch_size)
+        else:
+            slices = None
         for key, item in data.items():
-            if key in self.np_key:
+            if key in self.obj_key:
+                # a 1-D object array holding the items. np.asarray would convert array-like items (e.g., LazyFrames)
+                item = np.fromiter(item, dtype=object, count=batch_size)
+            elif key not in self.np_key:
+                raise ValueError(f'Unknown type {type(item)}')
+            if slices is None:
                 self.storage[key][index] = item
-            elif key in self.obj_key:
-                for i in range(batch_size):
-                    self.storage[key][(self.ptr + i) % self.max_size] = item[i]
             else:
-                raise ValueError(f'Unknown type {type(item)}')
+                start = 0
+                for s in slices:
+                    end = start + s.stop - s.start
+                    self.storage[key][s] = item[start:end]
+                    start = end
 
         self.ptr = (self.ptr + batch_size) % self.capacity
         self.size = min(self.size + batch_size, self.capacity)
@@ -4,13 +4,18 @@ from typing import Dict
 import numpy as np
 from gym.utils import seeding
 
+from rlutils.np.functional import stack_array_likes
 from . import storage, utils
 
 
 class UniformReplayBuffer(object):
-    def __init__(self, capacity, data_spec, seed=None):
+    # number of uniform samples drawn at once to generate the sampling indexes
+    uniform_pool_size = 65536
+
+    def __init__(self, capacity, data_spec, seed=None, store_dtype=None, cast_on_read=True):
         self.data_spec = data_spec
-        self.storage = storage.PyDictStorage(self.data_spec, capacity)
+        self.storage = storage.PyDictStorage(self.data_spec, capacity, store_dtype=store_dtype,
+                                             cast_on_read=cast_on_read)
         self.set_seed(seed)
 
         self.lock = threading.Lock()
@@ -39,16 +44,41 @@ class UniformReplayBuffer(object):
 
     def set_seed(self, seed=None):
         self.np_random, self.seed = seeding.np_random(seed)
+        self.uniform_pool = np.empty(shape=(0,))
+        self.uniform_pool_ptr = 0
+
+    def _sample_indexes(self, batch_size):
+        """ One bulk RNG call is much cheaper than one call per batch. The pool holds uniform samples in [0, 1)
+        instead of indexes, so that it remains valid when the buffer grows.
+        """
+        if self.uniform_pool_ptr + batch_size > len(self.uniform_pool):
+            self.uniform_pool = self.np_random.random(size=max(self.uniform_pool_size, batch_size))
+            self.uniform_pool_ptr = 0
+        uniform = self.uniform_pool[self.uniform_pool_ptr:self.uniform_pool_ptr + batch_size]
+        self.uniform_pool_ptr += batch_size
+        size = len(self.storage)
+        idxs = (uniform * size).astype(np.int64)
+        # u * size rounds up to size when u is close to 1
+        return np.minimum(idxs, size - 1, out=idxs)
 
     def sample(self, batch_size):
         assert not self.is_empty()
         with self.lock:
-            idxs = self.np_random.integers(0, len(self.storage), size=batch_size)
+            idxs = self._sample_indexes(batch_size)
             data = self.storage[idxs]
             for key in self.storage.obj_key:
-                data[key] = np.array(data[key])
+                data[key] = stack_array_likes(data[key])
             return data
 
+    def sample_many(self, num_batches, batch_size):
+        """ Sample num_batches minibatches with a single index draw and gather.
+        Returns a dictionary of arrays of shape (num_batches, batch_size, ...)
+        """
+        data = self.sample(num_batches * batch_size)
+        for key, item in data.items():
+            data[key] = np.reshape(item, (num_batches, batch_size) + item.shape[1:])
+        return data
+
     @classmethod
     def from_env(cls, env, memory_efficient, **kwargs):
         data_spec = utils.get_data_spec_from_env(env, memory_efficient=memory_efficient)
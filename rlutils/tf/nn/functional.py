@@ -72,16 +72,18 @@ def build_mlp(input_dim, output_dim, mlp_hidden, num_ensembles=None, num_layers=
         model.add(tf.keras.layers.Activation(activation=activation))
         if dropout is not None:
             model.add(tf.keras.layers.Dropout(rate=dropout))
-    # final layer
+    # final layer. Always computed in float32 so that the losses stay in float32 under a mixed precision policy.
     if num_ensembles is None:
         model.add(tf.keras.layers.Dense(output_dim, activation=out_activation, kernel_regularizer=out_regularizer,
                                         kernel_initializer=out_kernel_initializer,
-                                        bias_initializer=out_bias_initializer))
+                                        bias_initializer=out_bias_initializer,
+                                        dtype=tf.float32))
     else:
         model.add(EnsembleDense(num_ensembles, output_dim, activation=out_activation,
                                 kernel_regularizer=out_regularizer,
                                 kernel_initializer=out_kernel_initializer,
-                                bias_initializer=out_bias_initializer))
+                                bias_initializer=out_bias_initializer,
+                                dtype=tf.float32))
     if output_dim == 1 and squeeze is True:
-        model.add(SqueezeLayer(axis=-1))
+        model.add(SqueezeLayer(axis=-1, dtype=tf.float32))
     return model
@@ -6,8 +6,8 @@ from .initializer import _decode_initializer
 
 
 class SqueezeLayer(tf.keras.layers.Layer):
-    def __init__(self, axis=-1):
-        super(SqueezeLayer, self).__init__()
+    def __init__(self, axis=-1, **kwargs):
+        super(SqueezeLayer, self).__init__(**kwargs)
         self.axis = axis
 
     def call(self, inputs, **kwargs):
@@ -5,23 +5,22 @@ TD3 output activation=tf.
 
 import unittest
 
+import psutil
 import rlutils.infra as rl_infra
 
 
 def thunk(**kwargs):
     from rlutils.algos.tf.mf import sac
     from baselines.tf.mf import td3
-    temp = [sac, td3]
-    algo = kwargs.pop('algo')
-    eval(f'{algo}.Runner.main')(**kwargs)
+    runners = {'sac': sac.Runner, 'td3': td3.Runner}
+    runners[kwargs.pop('algo')].main(**kwargs)
 
 
 def thunk_pytorch(**kwargs):
     from rlutils.pytorch.algos.mf import td3 as td3_pytorch
     from rlutils.pytorch.algos.mf import sac as sac_pytorch
-    temp = [sac_pytorch, td3_pytorch]
-    algo = kwargs.pop('algo')
-    eval(f'{algo}.Runner.main')(**kwargs)
+    runners = {'sac_pytorch': sac_pytorch.Runner, 'td3_pytorch': td3_pytorch.Runner}
+    runners[kwargs.pop('algo')].main(**kwargs)
 
 
 class BenchmarkMujoco(unittest.TestCase):
@@ -36,7 +35,7 @@ class BenchmarkMujoco(unittest.TestCase):
         experiments.add(key='algo', vals=algo, in_name=True, shorthand='ALG')
         experiments.add(key='epochs', vals=300)
         experiments.add(key='seed', vals=SEEDS)
-        experiments.run(thunk=thunk_pytorch, data_dir='benchmark_results')
+        experiments.run(thunk=thunk_pytorch, data_dir='benchmark_results', num_parallel=NUM_PARALLEL)
 
     def test_sac_tf(self):
         algo = 'sac'
@@ -45,7 +44,7 @@ class BenchmarkMujoco(unittest.TestCase):
         experiments.add(key='algo', vals=algo, in_name=True, shorthand='ALG')
         experiments.add(key='epochs', vals=300)
         experiments.add(key='seed', vals=SEEDS)
-        experiments.run(thunk=thunk, data_dir='benchmark_results')
+        experiments.run(thunk=thunk, data_dir='benchmark_results', num_parallel=NUM_PARALLEL)
 
     def test_sac_original_tf(self):
         algo = 'sac'
@@ -58,7 +57,7 @@ class BenchmarkMujoco(unittest.TestCase):
         experiments.add(key='q_lr', vals=3e-4)
         experiments.add(key='policy_delay', vals=[1], in_name=True)
         experiments.add(key='target_policy', vals=[False], in_name=True)
-        experiments.run(thunk=thunk, data_dir='benchmark_results')
+        experiments.run(thunk=thunk, data_dir='benchmark_results', num_parallel=NUM_PARALLEL)
 
     def test_td3_update_every(self):
         algo = 'td3'
@@ -68,7 +67,7 @@ class BenchmarkMujoco(unittest.TestCase):
         experiments.add(key='algo', vals=algo, in_name=True, shorthand='ALG')
         experiments.add(key='epochs', vals=300)
         experiments.add(key='seed', vals=SEEDS)
-        experiments.run(thunk=thunk, data_dir='benchmark_results')
+        experiments.run(thunk=thunk, data_dir='benchmark_results', num_parallel=NUM_PARALLEL)
 
     def test_td3_out_activation(self):
         algo = 'td3'
@@ -79,7 +78,7 @@ class BenchmarkMujoco(unittest.TestCase):
         experiments.add(key='epochs', vals=300)
         experiments.add(key='seed', vals=SEEDS)
         experiments.add(key='out_activation', vals='sin', in_name=True)
-        experiments.run(thunk=thunk, data_dir='benchmark_results')
+        experiments.run(thunk=thunk, data_dir='benchmark_results', num_parallel=NUM_PARALLEL)
 
     def test_td3_num_ensembles(self):
         algo = 'td3'
@@ -90,7 +89,7 @@ class BenchmarkMujoco(unittest.TestCase):
         experiments.add(key='epochs', vals=300)
         experiments.add(key='seed', vals=SEEDS)
         experiments.add(key='num_q_ensembles', vals=[4, 6, 8], in_name=True)
-        experiments.run(thunk=thunk, data_dir='benchmark_results')
+        experiments.run(thunk=thunk, data_dir='benchmark_results', num_parallel=NUM_PARALLEL)
 
 
 if __name__ == '__main__':
@@ -98,4 +97,6 @@ if __name__ == '__main__':
 
     SEEDS = os.environ.get('SEEDS').split()
     SEEDS = [int(s) for s in SEEDS]
+    # the runs are independent. By default, run as many at once as there are seeds, up to the physical cores
+    NUM_PARALLEL = int(os.environ.get('NUM_PARALLEL', min(len(SEEDS), psutil.cpu_count(logical=False))))
     unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+
+import numpy as np
+import scipy.signal
+
+from rlutils.np.functional import discount_cumsum
+
+
+def discount_cumsum_lfilter(x, discount):
+    return scipy.signal.lfilter([1], [1, float(-discount)], x[::-1], axis=0)[::-1]
+
+
+class TestNpFunctional(unittest.TestCase):
+    def test_discount_cumsum_1d(self):
+        x = np.random.randn(100)
+        output = discount_cumsum(x, 0.99)
+        assert output.dtype == np.float64
+        np.testing.assert_allclose(output, discount_cumsum_lfilter(x, 0.99))
+
+    def test_discount_cumsum_2d_float32(self):
+        x = np.random.randn(50, 3).astype(np.float32)
+        output = discount_cumsum(x, 0.95)
+        assert output.dtype == np.float32
+        assert output.shape == x.shape
+        np.testing.assert_allclose(output, discount_cumsum_lfilter(x, 0.95), rtol=1e-5, atol=1e-5)
+
+    def test_discount_cumsum_int(self):
+        x = np.arange(10, dtype=np.int32)
+        output = discount_cumsum(x, 0.9)
+        assert output.dtype == np.float64
+        np.testing.assert_allclose(output, discount_cumsum_lfilter(x, 0.9))
+
+    def test_discount_cumsum_empty(self):
+        output = discount_cumsum(np.zeros(shape=(0,), dtype=np.float32), 0.99)
+        assert output.shape == (0,)
+
+    def test_discount_cumsum_single(self):
+        output = discount_cumsum(np.array([2.5]), 0.99)
+        np.testing.assert_allclose(output, np.array([2.5]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -25,6 +25,22 @@ class TestReplayBuffer(unittest.TestCase):
         samples2 = replay.sample()
         np.testing.assert_array_equal(samples1['data'], samples2['data'])
 
+    def test_uniform_sample_many(self):
+        replay = replay_buffers.UniformReplayBuffer(
+            data_spec={'data': gym.spaces.Box(low=0, high=10, shape=(2,), dtype=np.int32)},
+            capacity=5,
+            seed=1)
+        replay.add(dict(
+            data=np.tile(np.arange(5, dtype=np.int32)[:, None], (1, 2))
+        ))
+
+        samples = replay.sample_many(3, 4)
+        assert samples['data'].shape == (3, 4, 2)
+        np.testing.assert_array_equal(samples['data'][..., 0], samples['data'][..., 1])
+
+        replay.set_seed(1)
+        np.testing.assert_array_equal(samples['data'].reshape(12, 2), replay.sample(12)['data'])
+
     def test_py_priority(self):
         capacity = 100
         replay = replay_buffers.DictPrioritizedReplayBuffer(
@@ -52,6 +68,24 @@ class TestReplayBuffer(unittest.TestCase):
         sample_prob = idxes_count / np.sum(idxes_count)
         np.testing.assert_allclose(sample_prob, probability, rtol=1e-2)
 
+    def test_priority_memory_efficient(self):
+        from gym.wrappers import LazyFrames
+        replay = replay_buffers.PrioritizedReplayBuffer(
+            data_spec={'obs': None, 'act': gym.spaces.Box(low=0, high=10, shape=(), dtype=np.int32)},
+            capacity=10,
+            seed=1)
+        frames = [np.full(shape=(3, 3), fill_value=i, dtype=np.uint8) for i in range(13)]
+        replay.add(dict(
+            obs=[LazyFrames(frames[i:i + 4]) for i in range(10)],
+            act=np.arange(10, dtype=np.int32)
+        ))
+
+        _, data = replay.sample(5)
+        assert isinstance(data['obs'], np.ndarray)
+        assert data['obs'].dtype == np.uint8
+        assert data['obs'].shape == (5, 4, 3, 3)
+        np.testing.assert_array_equal(data['obs'][:, 0, 0, 0], data['act'])
+
 
 if __name__ == '__main__':
     unittest.main()